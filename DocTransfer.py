@@ -5,9 +5,44 @@ from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
 from docx.enum.table import WD_ALIGN_VERTICAL
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 import os
+import io
+import sys
+import posixpath
+import re
+import hashlib
+import json
+import argparse
+import cProfile
+import csv
+import functools
+import time
+import tracemalloc
+import copy
+import shutil
+import tempfile
+from collections import namedtuple, deque, Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
 from zipfile import ZipFile
 from docx.oxml import OxmlElement
 from docx.oxml import parse_xml
+from docx.oxml.ns import qn, nsmap
+from docx.oxml.shape import CT_Inline
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.parts.image import ImagePart
+from docx.image.image import Image as DocxImage
+from docx.image.exceptions import UnrecognizedImageError
+from docx.opc.packuri import PackURI
+from docx.opc.part import Part
+from docx.oxml.parser import element_class_lookup
+from docx.enum.style import WD_STYLE_TYPE
+from docx.styles.styles import Styles
+from lxml import etree
+from docx.table import Table, _Cell, _Row
+from docx.oxml.table import CT_Tc
+from docx.text.paragraph import Paragraph
+from docx.text.run import Run
 
 # =============================== SECTION 1: Style mapping =============================================
 # Purpose: Defines the "style" for each paragraph based on the "style" in the original formatting.
@@ -36,13 +71,130 @@ style_mapping = {
 
 # =============================== SECTION 2: Content Extraction =============================================
 # Purpose: Extract text, paragraph properties, images, tables, and header/footer from source document.
-# Functions: 2.1 : is_paragraph_in_list
+# Functions: 2.0 : extract_source_document
+#            2.1 : is_paragraph_in_list
 #            2.2 : extract_revision_text
 #            2.3 : extract_approval_text
 #            2.4 : extract_document_information
 #            2.5 : extract_content_with_details
-#            2.6 : extract_and_copy_tables
+#            2.6 : extract_and_copy_tables / build_supplemental_tables
 #            2.7 : extract_images_from_docx
+#            2.8 : read_figure_images
+#            2.9 : stream_source_document / iter_content_streaming
+#            2.10: content records (ParagraphRecord, TableRecord) and their JSON Lines / msgpack files
+#            2.11: coalesce_runs
+#
+# The source document is parsed a single time by extract_source_document. Functions 2.2 - 2.7 accept
+# either a path or the dictionary returned by extract_source_document, so callers that already hold an
+# extraction never open the file again.
+#
+# Tables are found by the text of their first cell through a table index built once per document
+# (build_table_index). anchor_tables lists the tables whose data rows are carried into the same table of
+# the template: the first rows of each are its title and column headings, the rows below are data.
+
+anchor_tables = {
+    "revision_history": "Revision History",
+    "approvals": "Approval Table",
+}
+anchor_header_rows = 2
+
+# (2.0) Parse the source document once and collect every extracted artifact
+def extract_source_document(source_doc_path):
+    """Open the source DOCX once and return revision history, approvals, header/footer information,
+    body content, the tables for the supplemental document and the embedded media in one dictionary."""
+    source_doc = Document(source_doc_path)
+    table_index = build_table_index(source_doc.element.body.tbl_lst)
+    anchors = read_anchor_tables(table_index)
+
+    return {
+        "path": source_doc_path,
+        "document": source_doc,
+        "table_index": table_index,
+        "anchor_tables": anchors,
+        "revision_history": anchors.get("revision_history"),
+        "approvals": anchors.get("approvals"),
+        "doc_information": read_document_information(source_doc),
+        "content": read_content_with_details(source_doc),
+        "tables": [table._element for table in source_doc.tables],
+        "media": read_media_parts(source_doc),
+        **read_figure_images(source_doc),
+        "image_digests": {},
+    }
+
+
+def as_extraction(source):
+    """Return an extraction dictionary, parsing the source only if a path was given."""
+    if isinstance(source, dict):
+        return source
+    return extract_source_document(source)
+
+
+def docx_input(document):
+    """Return something python-docx and ZipFile can open: the path itself, or a stream over DOCX bytes."""
+    if isinstance(document, (bytes, bytearray)):
+        return io.BytesIO(document)
+    if hasattr(document, "read"):
+        return io.BytesIO(document.read())
+    return document
+
+
+def table_rows_text(table):
+    return [[cell.text.strip() for cell in row.cells] for row in table.rows]
+
+
+def build_table_index(tbl_elements):
+    """Map the normalized first cell text of each table to its w:tbl elements, in document order.
+
+    The first cell is read from the XML, so no cell grid is built for tables that are never looked up.
+    """
+    table_index = {}
+    for tbl in tbl_elements:
+        table_index.setdefault(normalize_cell_text(table_first_cell_text(tbl)), []).append(tbl)
+    return table_index
+
+
+def find_indexed_table_text(table_index, first_cell_text):
+    """Rows of text of the first indexed table whose first cell matches first_cell_text, or None."""
+    tables = table_index.get(normalize_cell_text(first_cell_text))
+    if not tables:
+        return None  # Return None if no matching table is found
+    return table_rows_text(Table(tables[0], None))
+
+
+def read_anchor_tables(table_index):
+    """Return {key: rows of text} for each table in anchor_tables (None if the document does not have it)."""
+    return {key: find_indexed_table_text(table_index, text) for key, text in anchor_tables.items()}
+
+
+def normalize_cell_text(text):
+    """Cell text with runs of whitespace collapsed and case folded, for matching tables by their first cell."""
+    return " ".join(text.split()).casefold()
+
+
+def is_anchor_table(record):
+    """True if a content record (2.10) is one of the anchor_tables, which are filled from the template (3.5)."""
+    if record.type != "table" or not record.data or not record.data[0]:
+        return False
+    first_cell = normalize_cell_text(record.data[0][0].text)
+    return any(first_cell == normalize_cell_text(text) for text in anchor_tables.values())
+
+
+def table_first_cell_text(tbl):
+    """Text of the first cell of a w:tbl element, read from the XML without building python-docx objects."""
+    tc = next(tbl.iter(qn('w:tc')), None)
+    if tc is None:
+        return ""
+    return "\n".join(paragraph_element_text(p) for p in tc.iter(qn('w:p')))
+
+
+def read_media_parts(doc):
+    """List (file name, bytes) for every image stored under word/media in the parsed package."""
+    media = []
+    for part in doc.part.package.iter_parts():
+        if part.partname.startswith('/word/media/'):
+            media.append((part.partname.split('/')[-1], part.blob))
+    return media
+
 
 # (2.1) Determine if a paragraph is part of a list
 def is_paragraph_in_list(paragraph):
@@ -54,33 +206,23 @@ def is_paragraph_in_list(paragraph):
 
 # (2.2) Extract revision text
 def extract_revision_text(source_doc_path, first_cell_text="Revision History"):
-
-    source_doc = Document(source_doc_path)
-
-    for table in source_doc.tables:
-        if table.cell(0, 0).text.strip() == first_cell_text:
-            return [[cell.text.strip() for cell in row.cells] for row in table.rows]
-
-    return None  # Return None if no matching table is found
+    source = as_extraction(source_doc_path)
+    return find_indexed_table_text(source["table_index"], first_cell_text)
 
 
 
 # (2.3) Extract approval text
 def extract_approval_text(source_doc_path, first_cell_text="Approval Table"):
-
-    source_doc = Document(source_doc_path)
-
-    for table in source_doc.tables:
-        if table.cell(0, 0).text.strip() == first_cell_text:
-            return [[cell.text.strip() for cell in row.cells] for row in table.rows]
-
-    return None  # Return None if no matching table is found
+    source = as_extraction(source_doc_path)
+    return find_indexed_table_text(source["table_index"], first_cell_text)
 
 
 # (2.4)
 def extract_document_information(source_doc_path):
-    doc = Document(source_doc_path)
+    return as_extraction(source_doc_path)["doc_information"]
+
 
+def read_document_information(doc):
     header_content = None  
     footer_content = None  
 
@@ -92,7 +234,7 @@ def extract_document_information(source_doc_path):
         # Extract header
         try:
             for table in header.tables:
-                header_content = [[cell.text.strip() for cell in row.cells] for row in table.rows]
+                header_content = table_rows_text(table)
                 break  # Exit loop if header content found
         except:
             pass  # Skip header extraction if it fails
@@ -100,7 +242,7 @@ def extract_document_information(source_doc_path):
         # Extract footer
         try:
             for table in footer.tables:
-                footer_content = [[cell.text.strip() for cell in row.cells] for row in table.rows]
+                footer_content = table_rows_text(table)
                 break  # Exit loop if footer content found
         except:
             pass  # Skip footer extraction if it fails
@@ -110,81 +252,331 @@ def extract_document_information(source_doc_path):
 
 # (2.5)
 def extract_content_with_details(source_doc_path):
-    source_doc = Document(source_doc_path)
-    content = []
-    paragraph_idx = 0  # Index to track paragraphs
-    table_idx = 0      # Index to track tables
-
-    for block in source_doc.element.body:
-        if block.tag.endswith("p"):  # Paragraph
-            if paragraph_idx < len(source_doc.paragraphs):
-                p_obj = source_doc.paragraphs[paragraph_idx]
-                is_list = is_paragraph_in_list(p_obj)
-                content.append({
-                    "type": "paragraph",
-                    "text": p_obj.text,
-                    "style": p_obj.style.name,
-                    "is_list": is_list,
-                    "runs": [
-                        {
-                            "text": run.text,
-                            "bold": run.bold,
-                            "italic": run.italic
-                        }
-                        for run in p_obj.runs
-                    ]
-                })
-                paragraph_idx += 1
-        elif block.tag.endswith("tbl"):  # Table
-            if table_idx < len(source_doc.tables):
-                table_obj = source_doc.tables[table_idx]
-                table_data = []
-                for row in table_obj.rows:
-                    row_data = []
-                    for cell in row.cells:
-                        cell_text = cell.text.strip()
-                        cell_style = cell.paragraphs[0].style.name if cell.paragraphs else None
-                        row_data.append({
-                            "text": cell_text,
-                            "style": cell_style
-                        })
-                    table_data.append(row_data)
-                content.append({
-                    "type": "table",
-                    "data": table_data
-                })
-                table_idx += 1
-
-    return content
-
-
-# (2.6)
-def extract_and_copy_tables(source_doc_path, output_folder):
-    # Open the source document
-    source_doc = Document(source_doc_path)
+    """Body content as a list of dictionaries (a generator for a streamed source).
+
+    The extraction itself holds compact records (2.10); use source["content"] to work with those directly.
+    """
+    records = as_extraction(source_doc_path)["content"]
+    if isinstance(records, list):
+        return [record.to_dict() for record in records]
+    return (record.to_dict() for record in records)
+
+
+def read_content_with_details(source_doc):
+    style_names = {}  # Style ID -> style name, so each style is resolved only once
+
+    # Walk the body once, wrapping each paragraph and table as it is reached
+    return [
+        block_content(block, source_doc.styles, style_names)
+        for block in iter_block_items(source_doc.element.body, source_doc._body)
+    ]
+
+
+def block_content(block, styles, style_names):
+    """Convert one Paragraph or Table into a ParagraphRecord or TableRecord (2.10)."""
+    if isinstance(block, Paragraph):
+        is_list = is_paragraph_in_list(block)
+        return ParagraphRecord(
+            paragraph_element_text(block._p),
+            paragraph_style_name(block, styles, style_names),
+            is_list,
+            tuple(RunRecord(run.text, run.bold, run.italic) for run in block.runs),
+        )
+
+    table_data = []
+    for row in block.rows:
+        row_data = []
+        for cell in row.cells:
+            cell_blocks = list(iter_block_items(cell._tc, cell))
+            cell_paragraphs = [b for b in cell_blocks if isinstance(b, Paragraph)]
+            cell_style = paragraph_style_name(cell_paragraphs[0], styles, style_names) if cell_paragraphs else None
+            row_data.append(CellRecord(block_text(cell_blocks).strip(), cell_style))
+        table_data.append(tuple(row_data))
+    return TableRecord(tuple(table_data))
+
+
+def iter_block_items(parent_element, parent):
+    """Yield a Paragraph or Table for each w:p / w:tbl child of parent_element, in document order.
+
+    Content controls (w:sdt) are transparent: the paragraphs and tables inside them are yielded in place.
+    """
+    for child in parent_element.iterchildren():
+        if child.tag == qn('w:p'):
+            yield Paragraph(child, parent)
+        elif child.tag == qn('w:tbl'):
+            yield Table(child, parent)
+        elif child.tag == qn('w:sdt'):
+            sdt_content = child.find(qn('w:sdtContent'))
+            if sdt_content is not None:
+                yield from iter_block_items(sdt_content, parent)
+
+
+def block_text(blocks):
+    """Join the text of paragraphs and nested tables (tab between cells, newline between rows)."""
+    lines = []
+    for block in blocks:
+        if isinstance(block, Paragraph):
+            lines.append(paragraph_element_text(block._p))
+        else:
+            for row in block.rows:
+                lines.append("\t".join(block_text(iter_block_items(cell._tc, cell)) for cell in row.cells))
+    return "\n".join(lines)
 
 
-    # Create a new destination document
-    dest_doc = Document()
+def paragraph_style_name(paragraph, styles, style_names):
+    """Name of the paragraph's style, resolved the same way as paragraph.style.name and cached by style ID."""
+    style_id = paragraph._p.style
+    if style_id not in style_names:
+        style = styles.get_by_id(style_id, WD_STYLE_TYPE.PARAGRAPH)
+        style_names[style_id] = sys.intern(style.name) if style is not None else None
+    return style_names[style_id]
 
 
-    # Iterate over each table in the source document and copy it to the destination document
-    for table in source_doc.tables:
-        # Copy the table's XML and append it to the destination document
-        table_xml = table._element.xml  # Extract full table XML
-        new_table = parse_xml(table_xml)  # Parse into new table object
-        dest_doc._element.body.append(new_table)  # Append to the document
+# (2.6)
+def extract_and_copy_tables(source_doc_path, output_folder, first_cell_texts=None):
+    source = as_extraction(source_doc_path)
+    dest_doc = build_supplemental_tables(source, first_cell_texts)
 
 
     # Get the original document name and append "_supplemental_tables"
-    base_name = os.path.splitext(os.path.basename(source_doc_path))[0][:6]
-    destination_doc_name = f"{base_name}_supplemental_tables.docx"
-    destination_doc_path = os.path.join(output_folder, destination_doc_name)
+    destination_doc_path = os.path.join(output_folder, supplemental_name(source["path"]))
 
 
     # Save the destination document
     dest_doc.save(destination_doc_path)
     print(f"Tables extracted and saved to {destination_doc_path}")
+    return destination_doc_path
+
+
+def build_supplemental_tables(source, first_cell_texts=None):
+    """Return a new Document holding a copy of every source table, or only of the tables whose first cell
+    text is in first_cell_texts (compared with normalize_cell_text).
+
+    Table elements are deep-copied straight from the parsed source, and the styles, numbering definitions,
+    images and hyperlinks they refer to are carried over, so the tables render as they do in the source.
+    """
+    # Create a new destination document
+    dest_doc = Document()
+    body = dest_doc.element.body
+
+    if first_cell_texts is not None:
+        wanted = {normalize_cell_text(text) for text in first_cell_texts}
+        tables = [tbl for tbl in source["tables"] if normalize_cell_text(table_first_cell_text(tbl)) in wanted]
+    else:
+        tables = source["tables"]
+
+    # Copy each table element in front of the section properties. Tables that touch are joined into one
+    # table by Word, so an empty paragraph separates them.
+    copies = []
+    for index, table_element in enumerate(tables):
+        if index:
+            body.add_p()
+        copies.append(body._insert_tbl(copy.deepcopy(table_element)))
+
+    copied_styles = copy_referenced_styles(source, dest_doc, copies)
+    copy_referenced_numbering(source, dest_doc, copies + copied_styles)
+    copy_referenced_parts(source, dest_doc, copies)
+    return dest_doc
+
+
+def source_part_element(source, rel_type):
+    """Root element of the source part related to the body by rel_type (RT.STYLES, RT.NUMBERING), or None."""
+    if source["document"] is not None:
+        for rel in source["document"].part.rels.values():
+            if rel.reltype == rel_type and not rel.is_external:
+                return rel.target_part.element
+        return None
+
+    name = next((name for part_type, name in source["package"]["rels"].values() if part_type == rel_type), None)
+    if name is None:
+        return None
+    with ZipFile(source["path"], 'r') as docx_zip:
+        return parse_xml(docx_zip.read(name))
+
+
+def copy_referenced_styles(source, dest_doc, elements):
+    """Copy the source styles used in elements into dest_doc, replacing styles with the same ID.
+
+    The styles they are based on or linked to, the source's default styles and its document defaults come
+    along, so text is formatted as in the source. Returns the copied style elements.
+    """
+    source_styles = source_part_element(source, RT.STYLES)
+    if source_styles is None:
+        return []
+    dest_styles = dest_doc.styles.element
+
+    by_id = {style.get(qn('w:styleId')): style for style in source_styles.iter(qn('w:style'))}
+    pending = [style_id for style_id, style in by_id.items() if style.get(qn('w:default')) in ('1', 'true')]
+    for element in elements:
+        for reference in element.iter(qn('w:tblStyle'), qn('w:pStyle'), qn('w:rStyle')):
+            pending.append(reference.get(qn('w:val')))
+
+    wanted = set()
+    while pending:
+        style_id = pending.pop()
+        if style_id in wanted or style_id not in by_id:
+            continue
+        wanted.add(style_id)
+        for reference in by_id[style_id].iter(qn('w:basedOn'), qn('w:link')):
+            pending.append(reference.get(qn('w:val')))
+
+    doc_defaults = source_styles.find(qn('w:docDefaults'))
+    if doc_defaults is not None:
+        old_defaults = dest_styles.find(qn('w:docDefaults'))
+        if old_defaults is not None:
+            dest_styles.replace(old_defaults, copy.deepcopy(doc_defaults))
+        else:
+            dest_styles.insert(0, copy.deepcopy(doc_defaults))
+
+    existing = {style.get(qn('w:styleId')): style for style in dest_styles.iter(qn('w:style'))}
+    copied = []
+    for style_id in sorted(wanted):
+        style = copy.deepcopy(by_id[style_id])
+        if style.get(qn('w:default')) in ('1', 'true'):
+            # Only one default style per type
+            for other in existing.values():
+                if other.get(qn('w:type')) == style.get(qn('w:type')) and other.get(qn('w:default')) is not None:
+                    del other.attrib[qn('w:default')]
+        if style_id in existing:
+            dest_styles.replace(existing[style_id], style)
+        else:
+            dest_styles.append(style)
+        existing[style_id] = style
+        copied.append(style)
+    return copied
+
+
+def copy_referenced_numbering(source, dest_doc, elements):
+    """Copy the list definitions used in elements into dest_doc under new IDs, and renumber the references."""
+    num_ids = {num_id.get(qn('w:val')) for element in elements for num_id in element.iter(qn('w:numId'))}
+    num_ids.discard('0')  # numId 0 removes numbering
+    if not num_ids:
+        return
+    source_numbering = source_part_element(source, RT.NUMBERING)
+    if source_numbering is None:
+        return
+    dest_numbering = dest_doc.part.numbering_part.element
+
+    next_num_id = max([int(num.get(qn('w:numId'))) for num in dest_numbering.iter(qn('w:num'))] + [0]) + 1
+    next_abstract_id = max([int(abstract.get(qn('w:abstractNumId')))
+                            for abstract in dest_numbering.iter(qn('w:abstractNum'))] + [-1]) + 1
+    abstracts = {abstract.get(qn('w:abstractNumId')): abstract for abstract in source_numbering.iter(qn('w:abstractNum'))}
+
+    num_map = {}
+    abstract_map = {}
+    for num in source_numbering.iter(qn('w:num')):
+        if num.get(qn('w:numId')) not in num_ids:
+            continue
+        new_num = copy.deepcopy(num)
+        new_num.set(qn('w:numId'), str(next_num_id))
+        num_map[num.get(qn('w:numId'))] = str(next_num_id)
+        next_num_id += 1
+
+        abstract_ref = new_num.find(qn('w:abstractNumId'))
+        abstract_id = abstract_ref.get(qn('w:val'))
+        if abstract_id not in abstract_map and abstract_id in abstracts:
+            new_abstract = copy.deepcopy(abstracts[abstract_id])
+            new_abstract.set(qn('w:abstractNumId'), str(next_abstract_id))
+            abstract_map[abstract_id] = str(next_abstract_id)
+            next_abstract_id += 1
+            # Every w:abstractNum comes before the first w:num
+            first_num = dest_numbering.find(qn('w:num'))
+            if first_num is not None:
+                first_num.addprevious(new_abstract)
+            else:
+                dest_numbering.append(new_abstract)
+        abstract_ref.set(qn('w:val'), abstract_map.get(abstract_id, abstract_id))
+
+        cleanup = dest_numbering.find(qn('w:numIdMacAtCleanup'))
+        if cleanup is not None:
+            cleanup.addprevious(new_num)
+        else:
+            dest_numbering.append(new_num)
+
+    for element in elements:
+        for num_id in element.iter(qn('w:numId')):
+            if num_id.get(qn('w:val')) in num_map:
+                num_id.set(qn('w:val'), num_map[num_id.get(qn('w:val'))])
+
+
+def copy_referenced_parts(source, dest_doc, elements):
+    """Relate dest_doc to the images, hyperlinks and other parts that elements refer to, and rewrite the
+    relationship IDs in elements to match. Images with the same bytes are stored once.
+
+    A reference to a relationship the source does not have is removed rather than left pointing at whatever
+    dest_doc relates under that ID: a hyperlink keeps its text, any other element is dropped.
+    """
+    dest_part = dest_doc.part
+    stored = {image_part.sha1: image_part for image_part in dest_part.package.image_parts}
+    r_namespace = '{%s}' % nsmap['r']
+    rId_map = {}
+
+    for element in elements:
+        for node in element.xpath('.//*[@r:*]'):
+            for name, rId in list(node.attrib.items()):
+                if not name.startswith(r_namespace):
+                    continue
+                if rId not in rId_map:
+                    rId_map[rId] = relate_source_part(source, dest_part, rId, stored)
+                    if rId_map[rId] is None:
+                        print(f"Warning: relationship {rId} in a table was not found in the source; "
+                              f"the reference to it was removed")
+                if rId_map[rId] is not None:
+                    node.set(name, rId_map[rId])
+                elif node.tag == qn('w:hyperlink'):
+                    del node.attrib[name]
+                else:
+                    node.getparent().remove(node)
+                    break
+
+
+def relate_source_part(source, dest_part, rId, stored):
+    """Relate dest_part to whatever relationship rId of the source body points at; return the new rId, or
+    None if the source has no such relationship."""
+    if source["document"] is not None:
+        rel = source["document"].part.rels.get(rId)
+        if rel is None:
+            return None
+        if rel.is_external:
+            return dest_part.relate_to(rel.target_ref, rel.reltype, is_external=True)
+        if rel.reltype != RT.IMAGE:
+            return dest_part.relate_to(rel.target_part, rel.reltype)
+    else:
+        if rId in source["package"]["external_rels"]:
+            rel_type, target = source["package"]["external_rels"][rId]
+            return dest_part.relate_to(target, rel_type, is_external=True)
+        if rId not in source["package"]["rels"]:
+            return None
+        rel_type, name = source["package"]["rels"][rId]
+        if rel_type != RT.IMAGE:
+            # Embedded objects, charts and the like are copied as they are stored in the source package
+            with ZipFile(source["path"], 'r') as docx_zip:
+                if name not in docx_zip.namelist():
+                    return None
+                blob = docx_zip.read(name)
+            part = Part(PackURI('/' + name), source["package"]["content_types"][name], blob, dest_part.package)
+            return dest_part.relate_to(part, rel_type)
+
+    image_part = source_image_part(source, rId)
+    dest_image_part = add_image_part(dest_part.package, stored, image_part.partname.ext, image_part.content_type,
+                                     image_part.blob)
+    return dest_part.relate_to(dest_image_part, RT.IMAGE)
+
+
+def add_image_part(package, stored, ext, content_type, blob):
+    """Return the image part in stored ({SHA-1: part}) with these bytes, adding a new one to package if needed."""
+    sha1 = hashlib.sha1(blob).hexdigest()
+    if sha1 not in stored:
+        image_part = ImagePart(package.image_parts._next_image_partname(ext), content_type, blob)
+        package.image_parts.append(image_part)
+        stored[sha1] = image_part
+    return stored[sha1]
+
+
+def supplemental_name(document_name):
+    """File name of the supplemental tables document: the first six characters of the document name."""
+    base_name = os.path.splitext(os.path.basename(document_name))[0][:6]
+    return f"{base_name}_supplemental_tables.docx"
 
 
 # (2.7)
@@ -193,21 +585,496 @@ def extract_images_from_docx(docx_path, output_dir):
     os.makedirs(output_dir, exist_ok=True)
 
 
-    # Open the DOCX file as a ZIP archive
+    # Images were collected from word/media/ when the package was parsed
+    for image_name, image_data in as_extraction(docx_path)["media"]:
+        # Save the image to the output directory
+        image_path = os.path.join(output_dir, image_name)
+        with open(image_path, 'wb') as img_file:
+            img_file.write(image_data)
+        print(f"Extracted image: {image_name}")
+
+
+# (2.8) Map each "Figure N" caption to the images that precede it
+def read_figure_images(source_doc):
+    """Return {"figures": {number: [image, ...]}, "unplaced_images": [image, ...], "missing_images": [image, ...]}
+    for the body.
+
+    Each image is {"rId", "cx", "cy"}: its relationship ID in the source document part and its displayed
+    size in EMU (None for VML pictures whose shape has no size). Images, including those in table cells, are
+    assigned to the first body "Figure N" caption that follows them, or that contains them; images after the
+    last caption are left unplaced. Images in the anchor tables are left out, as those tables are replaced by
+    the template's (3.5). Images whose relationship is missing from the document, or points outside the
+    package, cannot be transferred and are listed in "missing_images" instead.
+    """
+    figures = {}
+    pending = []
+    missing = []
+    anchor_first_cells = {normalize_cell_text(text) for text in anchor_tables.values()}
+    image_rIds = {rId for rId, rel in source_doc.part.rels.items() if not rel.is_external}
+
+    for block in iter_block_items(source_doc.element.body, source_doc._body):
+        if not isinstance(block, Paragraph):
+            if normalize_cell_text(table_first_cell_text(block._tbl)) not in anchor_first_cells:
+                pending.extend(stored_images(paragraph_images(block._tbl), image_rIds, missing))
+            continue
+
+        pending.extend(stored_images(paragraph_images(block._p), image_rIds, missing))
+        match = FIGURE_CAPTION.match(paragraph_element_text(block._p))
+        if match and pending:
+            figures.setdefault(match.group(1), []).extend(pending)
+            pending = []
+
+    return {"figures": figures, "unplaced_images": pending, "missing_images": missing}
+
+
+def stored_images(images, image_rIds, missing):
+    """Return the images whose rId is one of image_rIds (the package's own parts), adding the others to missing."""
+    stored = []
+    for image in images:
+        (stored if image["rId"] in image_rIds else missing).append(image)
+    return stored
+
+
+FIGURE_CAPTION = re.compile(r"Figure\s+(\d+)\b")
+
+
+def paragraph_element_text(p_element):
+    """Text of a w:p element, the same as python-docx's Paragraph.text, without building a Paragraph."""
+    return "".join(str(node) for node in PARAGRAPH_TEXT_NODES(p_element))
+
+
+# The nodes Paragraph.text is made of, in document order, found with one compiled expression per paragraph
+PARAGRAPH_TEXT_NODES = etree.XPath(" | ".join(
+    f"./{parent}w:r/w:{tag}"
+    for parent in ("", "w:hyperlink/")
+    for tag in ("br", "cr", "noBreakHyphen", "ptab", "t", "tab")
+), namespaces={"w": nsmap["w"]})
+
+
+def paragraph_images(p_element):
+    """List the images drawn inside one paragraph element, or in every cell of a table element, in document order."""
+    images = []
+    for element in p_element.iter(qn('wp:inline'), qn('wp:anchor'), VML_IMAGEDATA):
+        if element.tag == VML_IMAGEDATA:
+            rId = element.get(qn('r:id'))
+            cx, cy = vml_shape_size(element.getparent())
+        else:
+            blips = element.xpath('.//a:blip/@r:embed')
+            extent = element.find(qn('wp:extent'))
+            rId = blips[0] if blips else None
+            cx = int(extent.get('cx')) if extent is not None else None
+            cy = int(extent.get('cy')) if extent is not None else None
+        if rId:
+            images.append({"rId": rId, "cx": cx, "cy": cy})
+    return images
+
+
+VML_IMAGEDATA = '{urn:schemas-microsoft-com:vml}imagedata'
+VML_UNITS = {"pt": 12700, "in": 914400, "cm": 360000, "mm": 36000, "pc": 152400, "px": 9525, "": 9525}  # EMU per unit
+
+
+def vml_shape_size(shape):
+    """(width, height) in EMU from the style of a v:shape, such as "width:432pt;height:288pt", or (None, None)."""
+    size = {}
+    for declaration in (shape.get('style') or "").split(';'):
+        name, _, value = declaration.partition(':')
+        match = re.fullmatch(r'\s*([\d.]+)\s*([a-z]*)\s*', value)
+        if name.strip() in ("width", "height") and match and match.group(2) in VML_UNITS:
+            size[name.strip()] = int(float(match.group(1)) * VML_UNITS[match.group(2)])
+    if size.get("width") and size.get("height"):
+        return size["width"], size["height"]
+    return None, None
+
+
+# (2.9) Streaming extraction for very large source documents
+def stream_source_document(source_doc_path):
+    """Return an extraction dictionary whose "content" is a generator that reads word/document.xml
+    incrementally from the ZipFile, instead of building the python-docx tree for the whole document.
+
+    The body is never held in memory as a whole. The other entries (revision history, approvals,
+    header/footer information, tables, figures) are filled in while "content" is consumed, so they are
+    complete once the writer has used every block. Body tables are spooled to a temporary file for the
+    supplemental document (SpooledTables), and only the anchor tables are kept in "table_index".
+    """
+    with ZipFile(source_doc_path, 'r') as docx_zip:
+        package = read_package_index(docx_zip)
+
+    source = {
+        "path": source_doc_path,
+        "document": None,
+        "package": package,
+        "table_index": {},
+        "anchor_tables": {},
+        "revision_history": None,
+        "approvals": None,
+        "doc_information": [None, None],
+        "tables": SpooledTables(),
+        "media": iter_media_entries(source_doc_path),
+        "figures": {},
+        "unplaced_images": [],
+        "missing_images": [],
+        "image_digests": {},
+    }
+    source["content"] = iter_content_streaming(source_doc_path, source)
+    return source
+
+
+def iter_content_streaming(source_doc_path, source=None):
+    """Yield the body blocks of the document one at a time, as the same records extract_source_document
+    produces (2.10); record.to_dict() gives the extract_content_with_details format.
+
+    If an extraction dictionary from stream_source_document is passed as source, its other entries are
+    filled in along the way.
+    """
+    with ZipFile(source_doc_path, 'r') as docx_zip:
+        package = source["package"] if source else read_package_index(docx_zip)
+        styles = Styles(parse_xml(docx_zip.read(package["styles"]))) if package["styles"] else None
+        style_names = {}
+        pending_images = []
+        section_parts = []  # [(header part name, footer part name)] for each section, in document order
+        anchor_first_cells = {normalize_cell_text(text) for text in anchor_tables.values()}
+
+        with docx_zip.open(package["document"]) as document_xml:
+            context = etree.iterparse(document_xml, events=('end',), tag=(qn('w:p'), qn('w:tbl'), qn('w:sectPr')),
+                                      remove_blank_text=True)
+            context.set_element_class_lookup(element_class_lookup)
+
+            for _, element in context:
+                if element.tag == qn('w:sectPr'):
+                    section_parts.append(section_header_footer(element, package))
+                    continue
+
+                # Only body-level blocks (directly in w:body or inside content controls) are emitted
+                container = element.getparent()
+                while container.tag in (qn('w:sdtContent'), qn('w:sdt')):
+                    container = container.getparent()
+                if container.tag != qn('w:body'):
+                    continue
+
+                if element.tag == qn('w:p'):
+                    block = Paragraph(element, None)
+                    if source is not None:
+                        pending_images.extend(stored_images(paragraph_images(element), package["rels"],
+                                                            source["missing_images"]))
+                        match = FIGURE_CAPTION.match(paragraph_element_text(element))
+                        if match and pending_images:
+                            source["figures"].setdefault(match.group(1), []).extend(pending_images)
+                            pending_images = []
+                else:
+                    block = Table(element, None)
+                    first_cell = normalize_cell_text(table_first_cell_text(element))
+                    if source is not None and first_cell not in anchor_first_cells:
+                        pending_images.extend(stored_images(paragraph_images(element), package["rels"],
+                                                            source["missing_images"]))
+                    if source is not None and element.getparent().tag == qn('w:body'):
+                        source["tables"].append(element)
+                        if first_cell in anchor_first_cells:
+                            source["table_index"].setdefault(first_cell, []).append(copy.deepcopy(element))
+
+                yield block_content(block, styles, style_names)
+
+                # Release the finished block and everything before it
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+
+        if source is not None:
+            source["unplaced_images"] = pending_images
+            source["doc_information"] = read_streamed_document_information(docx_zip, section_parts)
+            source["anchor_tables"] = read_anchor_tables(source["table_index"])
+            source["revision_history"] = source["anchor_tables"].get("revision_history")
+            source["approvals"] = source["anchor_tables"].get("approvals")
+
+
+class SpooledTables:
+    """Table elements kept as XML in a temporary file, so a streamed source does not hold every table in
+    memory until the supplemental document is built. Iterating parses each table back, in order."""
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.sizes = []
+
+    def append(self, tbl):
+        xml = etree.tostring(tbl)
+        self.file.seek(0, os.SEEK_END)
+        self.file.write(xml)
+        self.sizes.append(len(xml))
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def __iter__(self):
+        offset = 0
+        for size in self.sizes:
+            self.file.seek(offset)
+            yield parse_xml(self.file.read(size))
+            offset += size
+
+
+def read_package_index(docx_zip):
+    """Locate the main document, styles, headers/footers and images of a DOCX from its relationship files."""
+    package_rels = read_rels(docx_zip, '_rels/.rels', '')
+    document = next(target for rel_type, target in package_rels.values() if rel_type.endswith('/officeDocument'))
+
+    document_folder = posixpath.dirname(document)
+    rels_name = posixpath.join(document_folder, '_rels', posixpath.basename(document) + '.rels')
+    document_rels = read_rels(docx_zip, rels_name, document_folder)
+    styles = next((target for rel_type, target in document_rels.values() if rel_type.endswith('/styles')), None)
+
+    content_types = etree.fromstring(docx_zip.read('[Content_Types].xml'))
+    defaults = {}
+    overrides = {}
+    for element in content_types:
+        if element.tag.endswith('Default'):
+            defaults[element.get('Extension').lower()] = element.get('ContentType')
+        elif element.tag.endswith('Override'):
+            overrides[element.get('PartName').lstrip('/')] = element.get('ContentType')
+
+    def content_type(name):
+        return overrides.get(name) or defaults.get(name.rsplit('.', 1)[-1].lower())
+
+    return {
+        "document": document,
+        "styles": styles,
+        "rels": document_rels,
+        "content_types": {target: content_type(target) for _, target in document_rels.values()},
+        "external_rels": read_rels(docx_zip, rels_name, document_folder, external=True),
+    }
+
+
+def read_rels(docx_zip, rels_name, base_folder, external=False):
+    """Return {rId: (relationship type, zip member name)} for the internal relationships in rels_name, or
+    {rId: (relationship type, target)} for the external ones (such as hyperlinks) when external is True."""
+    if rels_name not in docx_zip.namelist():
+        return {}
+
+    rels = {}
+    for rel in etree.fromstring(docx_zip.read(rels_name)):
+        if (rel.get('TargetMode') == 'External') != external:
+            continue
+        if external:
+            rels[rel.get('Id')] = (rel.get('Type'), rel.get('Target'))
+            continue
+        target = rel.get('Target')
+        if target.startswith('/'):
+            name = target.lstrip('/')
+        else:
+            name = posixpath.normpath(posixpath.join(base_folder, target))
+        rels[rel.get('Id')] = (rel.get('Type'), name)
+    return rels
+
+
+def section_header_footer(sect_pr, package):
+    """Zip member names of the default header and footer referenced by a w:sectPr (None if not set)."""
+    parts = []
+    for reference in (qn('w:headerReference'), qn('w:footerReference')):
+        name = None
+        for element in sect_pr.iterchildren(reference):
+            if element.get(qn('w:type')) == 'default':
+                name = package["rels"].get(element.get(qn('r:id')), (None, None))[1]
+        parts.append(name)
+    return tuple(parts)
+
+
+def read_streamed_document_information(docx_zip, section_parts):
+    """Same result as read_document_information: the first table of the last section header and footer
+    that contain one. A section without its own header or footer uses the previous section's."""
+    header_content = None
+    footer_content = None
+    header_name = footer_name = None
+
+    for own_header, own_footer in section_parts:
+        header_name = own_header or header_name
+        footer_name = own_footer or footer_name
+        header_table = first_part_table(docx_zip, header_name)
+        footer_table = first_part_table(docx_zip, footer_name)
+        if header_table is not None:
+            header_content = table_rows_text(header_table)
+        if footer_table is not None:
+            footer_content = table_rows_text(footer_table)
+
+    return [header_content, footer_content]
+
+
+def first_part_table(docx_zip, part_name):
+    if part_name is None:
+        return None
+    part_element = parse_xml(docx_zip.read(part_name))
+    tbl = part_element.find(qn('w:tbl'))
+    return Table(tbl, None) if tbl is not None else None
+
+
+def iter_media_entries(docx_path):
+    """Yield (file name, bytes) for each word/media entry, reading one image at a time."""
     with ZipFile(docx_path, 'r') as docx_zip:
-        # Extract all the relationships to identify the images
         for file in docx_zip.namelist():
             if file.startswith('word/media/'):
-                # Extract the image file
-                image_name = file.split('/')[-1]
-                image_data = docx_zip.read(file)
+                yield file.split('/')[-1], docx_zip.read(file)
+
+
+def source_image_part(source, rId):
+    """Return the ImagePart for relationship rId of the source document body.
+
+    For a streamed source the image bytes are read from the ZipFile at this point.
+    """
+    if source["document"] is not None:
+        return source["document"].part.related_parts[rId]
+
+    name = source["package"]["rels"][rId][1]
+    with ZipFile(source["path"], 'r') as docx_zip:
+        blob = docx_zip.read(name)
+    return ImagePart(PackURI('/' + name), source["package"]["content_types"][name], blob)
+
+
+def source_image_digest(source, rId, blob=None):
+    """SHA-256 (hex) of the bytes of source image rId, kept in source["image_digests"].
+
+    Pass blob when the bytes have already been read, so the image is hashed without being read again;
+    otherwise they are read once with source_image_part.
+    """
+    digests = source["image_digests"]
+    if rId not in digests:
+        if blob is None:
+            blob = source_image_part(source, rId).blob
+        digests[rId] = hashlib.sha256(blob).hexdigest()
+    return digests[rId]
 
 
-                # Save the image to the output directory
-                image_path = os.path.join(output_dir, image_name)
-                with open(image_path, 'wb') as img_file:
-                    img_file.write(image_data)
-                print(f"Extracted image: {image_name}")
+# (2.10) Compact records for extracted body content
+# Each block is a tuple subclass with no per-instance dictionary; style names are interned, so a style used
+# by thousands of paragraphs is stored once. to_dict() gives the extract_content_with_details format.
+class RunRecord(namedtuple("RunRecord", "text bold italic")):
+    __slots__ = ()
+
+    def to_dict(self):
+        return {"text": self.text, "bold": self.bold, "italic": self.italic}
+
+
+class ParagraphRecord(namedtuple("ParagraphRecord", "text style is_list runs")):
+    __slots__ = ()
+    type = "paragraph"
+
+    def to_dict(self):
+        return {"type": "paragraph", "text": self.text, "style": self.style, "is_list": self.is_list,
+                "runs": [run.to_dict() for run in self.runs]}
+
+
+class CellRecord(namedtuple("CellRecord", "text style")):
+    __slots__ = ()
+
+    def to_dict(self):
+        return {"text": self.text, "style": self.style}
+
+
+class TableRecord(namedtuple("TableRecord", "data")):
+    __slots__ = ()
+    type = "table"
+
+    def to_dict(self):
+        return {"type": "table", "data": [[cell.to_dict() for cell in row] for row in self.data]}
+
+
+def record_from_dict(item):
+    """Convert one extract_content_with_details dictionary back into a record."""
+    if item["type"] == "paragraph":
+        return ParagraphRecord(
+            item["text"],
+            sys.intern(item["style"]) if item["style"] is not None else None,
+            item.get("is_list", False),
+            tuple(RunRecord(run["text"], run["bold"], run["italic"]) for run in item["runs"]),
+        )
+    return TableRecord(tuple(
+        tuple(CellRecord(cell["text"], sys.intern(cell["style"]) if cell["style"] else cell["style"]) for cell in row)
+        for row in item["data"]
+    ))
+
+
+def as_record(item):
+    return record_from_dict(item) if isinstance(item, dict) else item
+
+
+def record_to_row(record):
+    """Compact list form used in the files: ["p", text, style, is_list, [[text, bold, italic], ...]] or
+    ["t", [[[text, style], ...], ...]]."""
+    if record.type == "paragraph":
+        return ["p", record.text, record.style, record.is_list, [list(run) for run in record.runs]]
+    return ["t", [[list(cell) for cell in row] for row in record.data]]
+
+
+def record_from_row(row):
+    if row[0] == "p":
+        return ParagraphRecord(row[1], sys.intern(row[2]) if row[2] is not None else None, row[3],
+                               tuple(RunRecord(*run) for run in row[4]))
+    return TableRecord(tuple(
+        tuple(CellRecord(text, sys.intern(style) if style is not None else None) for text, style in row)
+        for row in row[1]
+    ))
+
+
+def write_content_records(content, path):
+    """Save content (records or dictionaries) as JSON Lines, or as msgpack if path ends in .msgpack."""
+    rows = (record_to_row(as_record(item)) for item in content)
+    if path.endswith('.msgpack'):
+        try:
+            import msgpack
+        except ImportError:
+            raise ImportError("Writing .msgpack files requires the msgpack package (pip install msgpack).")
+        with open(path, 'wb') as f:
+            packer = msgpack.Packer()
+            for row in rows:
+                f.write(packer.pack(row))
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False, separators=(',', ':')))
+                f.write('\n')
+
+
+def read_content_records(path):
+    """Yield the records saved by write_content_records, one at a time."""
+    if path.endswith('.msgpack'):
+        try:
+            import msgpack
+        except ImportError:
+            raise ImportError("Reading .msgpack files requires the msgpack package (pip install msgpack).")
+        with open(path, 'rb') as f:
+            for row in msgpack.Unpacker(f, raw=False):
+                yield record_from_row(row)
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield record_from_row(json.loads(line))
+
+
+# (2.11) Merge the runs that Word split without changing the formatting
+def coalesce_runs(content, counts=None):
+    """Yield content with adjacent runs of each paragraph merged when their bold and italic match.
+
+    Spell-check marks and revision IDs split text into many runs that look the same once extracted; a
+    record keeps only bold and italic per run, so merging those runs writes the same text and formatting
+    with fewer elements. Works for lists and streamed content. If counts is given, the runs before and
+    after merging are tallied in it ("runs_before", "runs_after").
+    """
+    if counts is not None:
+        counts.setdefault("runs_before", 0)
+        counts.setdefault("runs_after", 0)
+
+    for item in content:
+        item = as_record(item)
+        if item.type == "paragraph":
+            runs = []
+            for run in item.runs:
+                if runs and runs[-1].bold == run.bold and runs[-1].italic == run.italic:
+                    runs[-1] = RunRecord(runs[-1].text + run.text, run.bold, run.italic)
+                else:
+                    runs.append(run)
+            if counts is not None:
+                counts["runs_before"] += len(item.runs)
+                counts["runs_after"] += len(runs)
+            if len(runs) < len(item.runs):
+                item = item._replace(runs=tuple(runs))
+        yield item
 
 
 # =============================== SECTION 3: Document Creation =============================================
@@ -216,10 +1083,19 @@ def extract_images_from_docx(docx_path, output_dir):
 #            3.2 : apply_paragraph_style
 #            3.3 : center_cell_content
 #            3.4 : set_font_size
-#            3.5 : input_approvals_revisions_text
+#            3.5 : input_approvals_revisions_text / apply_anchor_tables
 #            3.6 : write_content_with_existing_styles
 #            3.7 : italicize_and_resize_caption_style
 #            3.8 : insert_images_by_filename
+#            3.9 : run_destination_pipeline
+#            3.10: load_template / clone_template
+#            3.11: apply_transferred_images
+#            3.12: add_table_bulk
+#            3.13: optimize_image
+#
+# Functions 3.1, 3.5, 3.7 and 3.8 each have an apply_* counterpart that changes an open Document in memory.
+# The pipeline (3.9) chains those passes over a single Document and saves it once at the end; the path based
+# functions remain for running one step on an existing file.
 
 # (3.1) Input title, doc number, revision
 def input_document_information(finished_good, doc_information):
@@ -229,6 +1105,15 @@ def input_document_information(finished_good, doc_information):
         print(f"Error opening document: {e}")
         return
 
+    apply_document_information(doc, doc_information)
+
+    try:
+        doc.save(finished_good)
+    except Exception as e:
+        print(f"Error saving document: {e}")
+
+
+def apply_document_information(doc, doc_information):
     # Locate header and footer
     for section in doc.sections:
         header = section.header
@@ -282,11 +1167,6 @@ def input_document_information(finished_good, doc_information):
         except Exception as e:
             print(f"Error processing footer tables: {e}")
 
-    try:
-        doc.save(finished_good)
-    except Exception as e:
-        print(f"Error saving document: {e}")
-
 
 # (3.2)
 def apply_paragraph_style(paragraph, style_name):
@@ -323,104 +1203,146 @@ def set_font_size(cell, font_size):
 # (3.5) Function to input approvals and revision history
 def input_approvals_revisions_text(finished_good, revision_history, approvals):
     doc = Document(finished_good)
-
-    approval_count = 0
-    revision_count = 0
-    tables_to_remove = []
-
-
-    for index, table in enumerate(doc.tables):
-        if table.cell(0, 0).text.strip() == "Approval Table":
-            approval_count += 1
-            if approval_count == 2:  # Mark second occurrence for removal
-                tables_to_remove.append(index)
-            else:
-                for i in range(4):
-                    table.cell(2, i).text = approvals[2][i]
-                    table.cell(2, i).paragraphs[0].style = "00_TEXT"
+    apply_approvals_revisions_text(doc, revision_history, approvals)
+    doc.save(finished_good)
 
 
-        if table.cell(0, 0).text.strip() == "Revision History":
-            revision_count += 1
-            if revision_count == 2:  # Mark second occurrence for removal
-                tables_to_remove.append(index)
-            else:
-                for i in range(3):
-                    table.cell(2, i).text = revision_history[2][i]
-                    table.cell(2, i).paragraphs[0].style = "00_TEXT"
+def apply_approvals_revisions_text(doc, revision_history, approvals):
+    apply_anchor_tables(doc, {"revision_history": revision_history, "approvals": approvals})
+
+
+def apply_anchor_tables(doc, anchors, template_doc=None):
+    """Fill the first table of doc for each entry in anchor_tables with the source's data rows, and remove
+    the later tables with the same first cell (the copy that came in with the body content).
+
+    anchors is {key: rows of text} as read from the source (2.0); a missing table leaves the template's
+    table unchanged. Tables are found through one table index of doc. When doc is an existing output being
+    updated, pass the template as template_doc: rows left over from the previous data are then cleared,
+    or removed if the template's table did not have them, and a table the source no longer has is replaced
+    with the template's copy.
+    """
+    table_index = build_table_index(doc.element.body.tbl_lst)
+    template_index = build_table_index(template_doc.element.body.tbl_lst) if template_doc is not None else {}
+
+    for key, first_cell_text in anchor_tables.items():
+        tables = table_index.get(normalize_cell_text(first_cell_text), [])
+        template_tables = template_index.get(normalize_cell_text(first_cell_text))
+        if tables and anchors.get(key):
+            keep_rows = len(template_tables[0].tr_lst) if template_tables else None
+            fill_anchor_table(Table(tables[0], doc._body), anchors[key][anchor_header_rows:], keep_rows)
+        elif tables and template_tables:
+            # Put back the template's table, as converting the document in full would leave it
+            tables[0].addprevious(copy.deepcopy(template_tables[0]))
+            tables[0].getparent().remove(tables[0])
+
+        # Remove tables marked for deletion
+        for tbl in tables[1:]:
+            tbl.getparent().remove(tbl)
+
+
+def fill_anchor_table(table, data_rows, keep_rows=None):
+    """Write each non-empty row of data_rows into the rows below the headings of table, adding rows
+    (formatted like the template's first data row) when the source has more than the template.
+
+    With keep_rows, the rows after the written ones are cleared, and removed beyond the first keep_rows.
+    """
+    tbl = table._tbl
+    data_rows = [row for row in data_rows if any(row)]
+    if len(tbl.tr_lst) == 0:
+        return
+    blank_row = copy.deepcopy(tbl.tr_lst[min(anchor_header_rows, len(tbl.tr_lst) - 1)])
+
+    for offset, row_text in enumerate(data_rows):
+        index = anchor_header_rows + offset
+        if index >= len(tbl.tr_lst):
+            tbl.tr_lst[-1].addnext(copy.deepcopy(blank_row))
+        for cell, text in zip(_Row(tbl.tr_lst[index], table).cells, row_text):
+            cell.text = text
+            cell.paragraphs[0].style = "00_TEXT"
+
+    if keep_rows is not None:
+        for index in range(len(tbl.tr_lst) - 1, anchor_header_rows + len(data_rows) - 1, -1):
+            tr = tbl.tr_lst[index]
+            if index >= keep_rows:
+                tbl.remove(tr)
+                continue
+            for cell in _Row(tr, table).cells:
+                if cell.text:
+                    cell.text = ""
 
 
-    # Remove tables marked for deletion
-    for i in sorted(tables_to_remove, reverse=True):  
-        tbl = doc.tables[i]._element
-        tbl.getparent().remove(tbl)
+# (3.6)
+def write_content_with_existing_styles(content, destination_doc_path, finished_good):
+    dest_doc = build_document_with_existing_styles(content, destination_doc_path)
 
+    # Save the modified document
+    dest_doc.save(finished_good)
+    print(f"Document saved to {finished_good}.")
 
-    doc.save(finished_good)
 
+def build_document_with_existing_styles(content, destination_doc_path):
+    """Write the extracted content into a copy of the template and return the open Document."""
+    # The template is parsed and its styles checked against style_mapping once per run (see 3.10)
+    dest_doc = clone_template(destination_doc_path)
 
-# (3.6)
-def write_content_with_existing_styles(content, destination_doc_path, finished_good):
-    dest_doc = Document(destination_doc_path)
+    # Paragraphs are appended as elements: each style name is resolved to its ID once, and each run is a copy
+    # of a prototype run that already carries its bold/italic formatting. The XML is the same as from
+    # add_paragraph(style=...) and add_run() with run.bold / run.italic set.
+    body = dest_doc.element.body
+    style_ids = {}
+    run_prototypes = {}
 
-    # Check if the required styles exist in the destination document
-    for item in content:
-        if item["type"] == "paragraph":
-            style_name = style_mapping.get(item["style"], None)
-            if style_name:
-                style_names = [s.name for s in dest_doc.styles]
-                if style_name not in style_names:
-                    raise ValueError(f"Style '{style_name}' not found in destination document.")
-
-    # Write the content in the same order
+    # Write the content in the same order; content may hold records (2.10) or dictionaries
     for item in content:
-        if item["type"] == "paragraph":
-            style_name = style_mapping.get(item["style"], "00_TEXT")  # Default to '00_TEXT' if not mapped
-            paragraph = dest_doc.add_paragraph(style=style_name)
+        item = as_record(item)
+        if item.type == "paragraph":
+            style_name = style_mapping.get(item.style, "00_TEXT")  # Default to '00_TEXT' if not mapped
 
             # Only apply list style if explicitly marked as a list and not a heading
-            if item.get("is_list", False) and "HEADING" not in style_name:
-                paragraph.style = "00_BULLET"  # Use mapped bullet list style
+            if item.is_list and "HEADING" not in style_name:
+                style_name = "00_BULLET"  # Use mapped bullet list style
 
-            # Write runs with formatting
-            for run_data in item["runs"]:
-                run = paragraph.add_run(run_data["text"])
-                run.bold = run_data["bold"]
-                run.italic = run_data["italic"]
+            if style_name not in style_ids:
+                style_ids[style_name] = dest_doc.part.get_style_id(style_name, WD_STYLE_TYPE.PARAGRAPH)
+            p = body.add_p()
+            p.style = style_ids[style_name]
 
-        elif item["type"] == "table":
+            # Write runs with formatting
+            for run_data in item.runs:
+                key = (run_data.bold, run_data.italic)
+                if key not in run_prototypes:
+                    run_prototypes[key] = run_prototype(run_data.bold, run_data.italic)
+                r = copy.deepcopy(run_prototypes[key])
+                r.text = run_data.text
+                p.append(r)
+
+        elif item.type == "table":
             # Add a table to the destination document
-            table_data = item["data"]
+            table_data = item.data
             if table_data:
-                table = dest_doc.add_table(rows=0, cols=len(table_data[0]))
-                table.style = 'Table Grid'  # Use a default table style
-
-                # Populate table rows with styles
-                for row_data in table_data:
-                    row = table.add_row()
-                    for idx, cell_data in enumerate(row_data):
-                        cell = row.cells[idx]
-                        cell.text = cell_data["text"]
-                        # Map and apply styles
-                        source_style = cell_data["style"]
-                        dest_style = style_mapping.get(source_style, None)
-                        if dest_style:
-                            for paragraph in cell.paragraphs:
-                                paragraph.style = dest_style
-                        # Apply alignment to non-title cells
-                        if dest_style != "00_TITLE TABLE":
-                            cell.paragraphs[0].alignment = WD_PARAGRAPH_ALIGNMENT.LEFT
-                            cell.vertical_alignment = WD_ALIGN_VERTICAL.CENTER
+                add_table_bulk(dest_doc, table_data)
+
+    return dest_doc
 
-    # Save the modified document
-    dest_doc.save(finished_good)
-    print(f"Document saved to {finished_good}.")
+
+def run_prototype(bold, italic):
+    """Empty w:r with the given bold and italic settings, to be copied for every run with that formatting."""
+    run = Run(OxmlElement('w:r'), None)
+    run.bold = bold
+    run.italic = italic
+    return run._r
 
 
 # (3.7)
 def italicize_and_resize_caption_style(finished_good):
     """Make all text with the 'Caption' style italicized and set font size to 9 in the DOCX document."""
     doc = Document(finished_good)
+    apply_caption_style(doc)
+    doc.save(finished_good)
+    print(f"Text with 'Caption' style has been italicized and resized to 9 points in {finished_good}.")
+
+
+def apply_caption_style(doc):
     for paragraph in doc.paragraphs:
         if paragraph.style.name == "00_PICTURE":
             for run in paragraph.runs:
@@ -431,8 +1353,6 @@ def italicize_and_resize_caption_style(finished_good):
                 run.italic = True
                 run.font.size = Pt(8)
             paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    doc.save(finished_good)
-    print(f"Text with 'Caption' style has been italicized and resized to 9 points in {finished_good}.")
 
 
 
@@ -440,7 +1360,20 @@ def italicize_and_resize_caption_style(finished_good):
 def insert_images_by_filename(destination_docx_path, image_folder):
     """Insert images into the DOCX file above their corresponding 'Figure X' text."""
     doc = Document(destination_docx_path)
-    paragraphs = doc.paragraphs
+    apply_images_by_filename(doc, image_folder)
+
+    # Save the updated document
+    doc.save(destination_docx_path)
+
+
+def apply_images_by_filename(doc, image_folder, image_policy=None, width=Inches(3.0)):
+    """Insert the images in image_folder above their 'Figure X' captions and return an image report.
+
+    Identical images are stored once. With an image_policy, images are first shrunk to the displayed width (3.13).
+    """
+    caption_index = build_caption_index(doc)
+    report = new_image_report()
+    stored = {image_part.sha1 for image_part in doc.part.package.image_parts}
 
     # Get a sorted list of images in the folder
     image_files = sorted(
@@ -451,91 +1384,1440 @@ def insert_images_by_filename(destination_docx_path, image_folder):
         # Extract the figure number from the filename (e.g., "image2.png" -> "2")
         figure_number = ''.join(filter(str.isdigit, os.path.splitext(image_file)[0]))
         if not figure_number.isdigit():
-            print(f"Skipping {image_file}: could not determine figure number.")
+            report["unmatched"].append({"image": image_file, "figure": None, "reason": "no figure number"})
             continue
 
-        figure_text = f"Figure {figure_number}"
-        image_path = os.path.join(image_folder, image_file)
-
-        # Search for the paragraph starting with "Figure X"
-        for para in paragraphs:
-            if para.text.startswith(figure_text):  # Checks if paragraph starts with "Figure X"
-                # Insert image above the paragraph containing "Figure X"
-                para_index = paragraphs.index(para)
-                para_before = paragraphs[para_index].insert_paragraph_before()
-                para_before.add_run().add_picture(image_path, width=Inches(3.0))  # Adjust width as needed
-                para_before.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                break
+        # Insert image above the paragraph containing "Figure X"
+        para_before = insert_above_caption(doc, caption_index, figure_number)
+        if para_before is None:
+            report["unmatched"].append({"image": image_file, "figure": figure_number, "reason": "caption not found"})
+            continue
+        with open(os.path.join(image_folder, image_file), 'rb') as f:
+            blob = f.read()
+        report["source_bytes"] += len(blob)
+        if image_policy is not None:
+            optimized = optimize_image(blob, width, image_policy)
+            report["optimized"] += optimized is not blob
+            blob = optimized
+
+        # add_picture reuses an image part with the same bytes, so only new bytes are stored
+        sha1 = hashlib.sha1(blob).hexdigest()
+        if sha1 in stored:
+            report["deduplicated"] += 1
         else:
-            print(f"Figure {figure_number} not found in the document. Skipping {image_file}.")
+            stored.add(sha1)
+            report["stored_bytes"] += len(blob)
+        picture = para_before.add_run().add_picture(io.BytesIO(blob), width=width)
+        # A stream has no file name, so name the picture after its file as add_picture(path) would
+        picture._inline.graphic.graphicData.pic.nvPicPr.cNvPr.name = image_file
+        report["inserted"].append({"image": image_file, "figure": figure_number})
 
-    # Save the updated document
-    doc.save(destination_docx_path)
-    print("Images inserted successfully!")
+    print_image_report(report)
 
     # Delete all images in the folder after completing
     for image_file in image_files:
-        image_path = os.path.join(image_folder, image_file)
-        os.remove(image_path)
-        print(f"Deleted {image_file} from {image_folder}")
+        os.remove(os.path.join(image_folder, image_file))
+
+    return report
+
+
+def new_image_report():
+    """Report filled in by the image passes: images placed above a caption, images that were not, and the
+    image bytes in the source compared with the bytes stored in the output."""
+    return {"inserted": [], "unmatched": [], "source_bytes": 0, "stored_bytes": 0, "deduplicated": 0, "optimized": 0}
+
+
+def print_image_report(report):
+    saved = report["source_bytes"] - report["stored_bytes"]
+    print(f"Images inserted: {len(report['inserted'])}, unmatched: {len(report['unmatched'])}, "
+          f"stored {report['stored_bytes']} of {report['source_bytes']} bytes ({saved} saved, "
+          f"{report['deduplicated']} duplicate(s), {report['optimized']} optimized)")
+
+
+def build_caption_index(doc):
+    """Map each figure number to the first body paragraph element whose text starts with 'Figure N'.
+
+    Built in one pass per document. The index holds elements rather than positions, so inserting image
+    paragraphs above a caption does not invalidate it.
+    """
+    caption_index = {}
+    for block in iter_block_items(doc.element.body, doc._body):
+        if isinstance(block, Paragraph):
+            match = FIGURE_CAPTION.match(paragraph_element_text(block._p))
+            if match:
+                caption_index.setdefault(match.group(1), block._p)
+    return caption_index
+
+
+def insert_above_caption(doc, caption_index, figure_number):
+    """Return a new centered paragraph directly above the caption of figure_number, or None if absent."""
+    caption = caption_index.get(figure_number)
+    if caption is None:
+        return None
+
+    para_before = Paragraph(caption, doc._body).insert_paragraph_before()
+    para_before.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    return para_before
+
+
+# (3.9) Apply post-processing passes to one in-memory document and save it once
+def run_destination_pipeline(doc, passes, finished_good, snapshot_folder=None, stages=None, snapshot_name=None):
+    """Run each (name, function) pass on doc in order, then save doc to finished_good (a path or a stream).
+
+    Returns {name: value returned by the pass}. If snapshot_folder is given, the document is also saved
+    there after every pass (named after snapshot_name, default finished_good) so the intermediate states
+    can be inspected when debugging. If a stages list is given, each pass and the final save are measured
+    into it (see Section 5).
+    """
+    results = {}
+    for step, (name, apply_pass) in enumerate(passes, start=1):
+        results[name] = run_stage(stages, name, apply_pass, doc)
+
+        if snapshot_folder:
+            os.makedirs(snapshot_folder, exist_ok=True)
+            base_name = os.path.splitext(os.path.basename(snapshot_name or document_label(finished_good)))[0]
+            snapshot_path = os.path.join(snapshot_folder, f"{base_name}_{step:02d}_{name}.docx")
+            doc.save(snapshot_path)
+            print(f"Snapshot after '{name}' saved to {snapshot_path}")
+
+    if isinstance(finished_good, str):
+        run_stage(stages, "save", save_atomically, doc, finished_good)
+    else:
+        run_stage(stages, "save", doc.save, finished_good)
+    print(f"Document saved to {document_label(finished_good)}.")
+    return results
+
+
+def save_atomically(doc, path):
+    """Save doc to a temporary file beside path and rename it into place, so readers never see a partial file.
+
+    The file gets the permissions of the file it replaces, or those of a newly created file. The temporary
+    file is created like any new file rather than with mkstemp, which makes it readable only by its owner, so
+    the process umask never has to be read (os.umask changes it for every thread while doing so).
+    """
+    folder = os.path.dirname(path) or "."
+    temp_path = os.path.join(folder, f".~doctransfer-{os.urandom(6).hex()}.tmp")
+    handle = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o666)
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            doc.save(f)
+        try:
+            os.chmod(temp_path, os.stat(path).st_mode & 0o7777)
+        except FileNotFoundError:
+            pass  # A new output keeps the permissions it was created with
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def document_label(destination):
+    """Name to print for a destination that is either a path or an in-memory stream."""
+    return destination if isinstance(destination, str) else "memory"
+
+
+
+
+# (3.10) Parse the template once per run and hand out copies of it
+template_cache = {}  # Absolute template path (or hash of template bytes) -> {"document", "style_names", "mtime"}
+
+
+def load_template(destination_doc_path):
+    """Return the cached template entry, parsing the file and validating style_mapping on first use.
+
+    destination_doc_path may also be the template's bytes, cached by their hash. An entry for a path is
+    reloaded if the template file changes on disk.
+    """
+    if isinstance(destination_doc_path, (bytes, bytearray)):
+        key = "sha256:" + hashlib.sha256(destination_doc_path).hexdigest()
+        mtime = None
+    else:
+        key = os.path.abspath(destination_doc_path)
+        mtime = os.path.getmtime(destination_doc_path)
+
+    cached = template_cache.get(key)
+    if cached is None or cached["mtime"] != mtime:
+        template_doc = Document(docx_input(destination_doc_path))
+        style_names = {style.name for style in template_doc.styles}
+        validate_style_mapping(style_names)
+        cached = {"document": template_doc, "style_names": style_names, "mtime": mtime}
+        template_cache[key] = cached
+
+    return cached
+
+
+def validate_style_mapping(style_names):
+    """Raise ValueError if any destination style named in style_mapping is missing from the template."""
+    missing = sorted({name for name in style_mapping.values() if name not in style_names})
+    if missing:
+        raise ValueError(f"Style(s) {', '.join(repr(name) for name in missing)} not found in destination document.")
+
+
+def clone_template(destination_doc_path):
+    """Return an independent copy of the cached template Document, without re-reading the file."""
+    return copy.deepcopy(load_template(destination_doc_path)["document"])
 
 
 
 
-#======================================= SECTION 4: Function Calls ============================================
-# Purpose: Call the functions from above to process all documents in the folder
+# (3.11) Move images from the source package straight into the destination package
+def apply_transferred_images(doc, source, width=Inches(3.0), image_policy=None):
+    """Insert each source figure image above its 'Figure N' caption in doc, without temporary files.
+
+    The image parts already loaded with the source package are added to the destination package as-is,
+    sharing the same bytes (a streamed source reads each image from its ZipFile once, here), and each is
+    sized from its displayed size in the source document. Images are matched to captions through the
+    relationship IDs recorded by read_figure_images (2.8). Images with the same bytes, in the source or
+    already in the template, are stored once. With an image_policy, images are first shrunk to the
+    displayed width (3.13).
+    """
+    dest_part = doc.part
+
+    caption_index = build_caption_index(doc)
+    report = new_image_report()
+
+    shape_id = dest_part.next_id
+    transferred = {}  # Source rId -> (destination rId, image part, file name), so an image used twice is stored once
+    stored = {image_part.sha1: image_part for image_part in dest_part.package.image_parts}  # By content hash
+
+    for figure_number, images in source["figures"].items():
+        if figure_number not in caption_index:
+            for image in images:
+                report["unmatched"].append({"image": image["rId"], "figure": figure_number, "reason": "caption not found"})
+            continue
+
+        for image in images:
+            # Each image is read once; its digest is kept for the content hash (4.6) and verification (5.6)
+            image_part = None
+            if image["rId"] not in transferred:
+                image_part = source_image_part(source, image["rId"])
+                source_image_digest(source, image["rId"], image_part.blob)
+
+            # Keep the aspect ratio the image was displayed with; only VML pictures without a size need the
+            # image probed, and python-docx cannot read the size of some formats (EMF/WMF)
+            if image["cx"] and image["cy"]:
+                cx, cy = width, int(image["cy"] * width / image["cx"])
+            else:
+                try:
+                    probed = image_part if image_part is not None else transferred[image["rId"]][1]
+                    cx, cy = DocxImage.from_blob(probed.blob).scaled_dimensions(width, None)
+                except UnrecognizedImageError:
+                    report["unmatched"].append({"image": image["rId"], "figure": figure_number,
+                                                "reason": "image size unknown"})
+                    continue
+
+            if image["rId"] not in transferred:
+                blob = image_part.blob
+                report["source_bytes"] += len(blob)
+                if image_policy is not None:
+                    optimized = optimize_image(blob, width, image_policy)
+                    report["optimized"] += optimized is not blob
+                    blob = optimized
+
+                stored_count = len(stored)
+                dest_image_part = add_image_part(dest_part.package, stored, image_part.partname.ext,
+                                                 image_part.content_type, blob)
+                if len(stored) > stored_count:
+                    report["stored_bytes"] += len(blob)
+                else:
+                    report["deduplicated"] += 1
+                # relate_to returns the existing rId when the part is already related to the document
+                transferred[image["rId"]] = (dest_part.relate_to(dest_image_part, RT.IMAGE), dest_image_part,
+                                             os.path.basename(image_part.partname))
+            rId, dest_image_part, filename = transferred[image["rId"]]
+
+            inline = CT_Inline.new_pic_inline(shape_id, rId, filename, cx, cy)
+            shape_id += 1
+
+            para_before = insert_above_caption(doc, caption_index, figure_number)
+            para_before.add_run()._r.add_drawing(inline)
+            report["inserted"].append({"image": image["rId"], "figure": figure_number})
+
+    for image in source["unplaced_images"]:
+        report["unmatched"].append({"image": image["rId"], "figure": None, "reason": "no caption follows image"})
+    for image in source["missing_images"]:
+        report["unmatched"].append({"image": image["rId"], "figure": None, "reason": "image not in source package"})
+
+    print_image_report(report)
+    return report
+
+
+
+
+# (3.12) Build a whole table in one pass from the extracted rows
+def add_table_bulk(dest_doc, table_data):
+    """Append a 'Table Grid' table holding table_data (rows of CellRecords) to dest_doc and return it.
+
+    The output is the same XML as adding each row with add_row() and setting every cell's text, style and
+    alignment through python-docx, but that formatting is done once per (source style, column width) on a
+    prototype cell. Each cell is then a copy of its prototype with the text filled in.
+    """
+    table = dest_doc.add_table(rows=0, cols=len(table_data[0]))
+    table.style = 'Table Grid'  # Use a default table style
+
+    tbl = table._tbl
+    widths = [gridCol.w for gridCol in tbl.tblGrid.gridCol_lst]
+    prototypes = {}
+
+    for row_data in table_data:
+        tr = tbl.add_tr()
+        for idx, width in enumerate(widths):
+            if idx >= len(row_data):
+                # Short rows keep the empty cells add_row() would have created
+                key = (None, width, False)
+                if key not in prototypes:
+                    prototypes[key] = CT_Tc.new()
+                    if width is not None:
+                        prototypes[key].width = width
+                tr.append(copy.deepcopy(prototypes[key]))
+                continue
+
+            cell_data = row_data[idx]
+            key = (cell_data.style, width, True)
+            if key not in prototypes:
+                prototypes[key] = table_cell_prototype(table, cell_data.style, width)
+            tc = copy.deepcopy(prototypes[key])
+            tc.p_lst[0].r_lst[0].text = cell_data.text
+            tr.append(tc)
+
+    return table
+
+
+def table_cell_prototype(table, source_style, width):
+    """An empty w:tc formatted for cells whose source paragraph style is source_style."""
+    tc = CT_Tc.new()
+    if width is not None:
+        tc.width = width
+    cell = _Cell(tc, table)
+    cell.text = ""
+
+    # Map and apply styles
+    dest_style = style_mapping.get(source_style, None)
+    if dest_style:
+        for paragraph in cell.paragraphs:
+            paragraph.style = dest_style
+    # Apply alignment to non-title cells
+    if dest_style != "00_TITLE TABLE":
+        cell.paragraphs[0].alignment = WD_PARAGRAPH_ALIGNMENT.LEFT
+        cell.vertical_alignment = WD_ALIGN_VERTICAL.CENTER
+    return tc
+
+
+
+# (3.13) Store images at the resolution they are displayed at
+default_image_policy = {
+    "dpi": 150,  # Pixels per inch kept at the displayed width
+    "jpeg_quality": 85,
+    "png_optimize": True,
+}
+
+
+def optimize_image(blob, width, image_policy):
+    """Return blob resampled to `width` (EMU) at the policy's DPI and recompressed, in the same format.
+
+    Only PNG and JPEG images are changed and images are never enlarged. The original bytes are returned
+    (the same object) whenever the result would not be smaller or Pillow cannot read the image.
+    image_policy overrides default_image_policy. Pillow is optional and only imported when a policy is used.
+    """
+    try:
+        from PIL import Image, UnidentifiedImageError
+    except ImportError:
+        raise ImportError("Resampling images requires the Pillow package (pip install Pillow).")
+    image_policy = {**default_image_policy, **image_policy}
+
+    try:
+        image = Image.open(io.BytesIO(blob))
+    except UnidentifiedImageError:
+        return blob
+    image_format = image.format
+    if image_format not in ("PNG", "JPEG"):
+        return blob
+
+    target_width = round(width / 914400 * image_policy["dpi"])  # 914400 EMU per inch
+    if 0 < target_width < image.width:
+        if image.mode in ("1", "P"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        target_height = max(1, round(image.height * target_width / image.width))
+        image = image.resize((target_width, target_height), Image.LANCZOS)
+
+    stream = io.BytesIO()
+    if image_format == "JPEG":
+        image.save(stream, "JPEG", quality=image_policy["jpeg_quality"], optimize=True,
+                   icc_profile=image.info.get("icc_profile"))
+    else:
+        image.save(stream, "PNG", optimize=image_policy["png_optimize"])
+    optimized = stream.getvalue()
+    return optimized if len(optimized) < len(blob) else blob
+
+
+
+
+# =============================== SECTION 4: Incremental Conversion Cache =============================================
+# Purpose: Remember what each output was built from, so unchanged documents are skipped on the next run.
+# Functions: 4.1 : file_hash
+#            4.2 : config_hash
+#            4.3 : load_manifest / save_manifest
+#            4.4 : is_up_to_date
+#            4.5 : manifest_entry
+#            4.6 : hash_body_content / can_update_in_place
+#
+# The manifest is a JSON file in the output folder keyed by source file name. Each entry stores the hashes of
+# the source document, the template and the conversion settings, plus the outputs written for it. It also
+# stores a hash of the body (everything but the anchor tables) and the header/footer and anchor table data,
+# so a source whose body is unchanged only has that data patched into its output (update_metadata, 6.2).
+
+manifest_name = '.doctransfer_manifest.json'
+
+
+# (4.1) Hash a file, reusing the hash stored in the manifest when size and modification time are unchanged
+def file_hash(path, cached=None):
+    stat = os.stat(path)
+    if cached and cached.get("size") == stat.st_size and cached.get("mtime_ns") == stat.st_mtime_ns:
+        return cached
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return {"sha256": digest.hexdigest(), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+# (4.2) Hash everything besides the source and template that changes the output
+def config_hash(options):
+    """Hash style_mapping, the conversion options and this script, so editing any of them reconverts."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps(style_mapping, sort_keys=True).encode('utf-8'))
+    digest.update(repr((options["transfer_images_in_memory"], options["stream"], options["image_policy"],
+                        options["supplemental_table_filter"], options["coalesce_runs"])).encode('utf-8'))
+    with open(os.path.abspath(__file__), 'rb') as f:
+        digest.update(f.read())
+    return digest.hexdigest()
+
+
+# (4.3) Read and write the manifest
+def load_manifest(folder):
+    manifest_path = os.path.join(folder, manifest_name)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"documents": {}}
+
+
+def save_manifest(folder, manifest):
+    """Write the manifest to a temporary file and rename it into place, so a crash never leaves it half written."""
+    manifest_path = os.path.join(folder, manifest_name)
+    temp_path = manifest_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(temp_path, manifest_path)
+
+
+# (4.4) Decide whether a source document needs converting
+def is_up_to_date(entry, source_info, template_info, settings_hash):
+    """True if the manifest entry was built from the same source, template and settings and its outputs exist."""
+    return (
+        entry is not None
+        and entry["source"]["sha256"] == source_info["sha256"]
+        and entry["template"] == template_info["sha256"]
+        and entry["config"] == settings_hash
+        and all(os.path.exists(path) for path in entry["outputs"] if path)
+    )
+
+
+# (4.5) Describe a finished conversion for the manifest
+def manifest_entry(source_info, template_info, settings_hash, result):
+    return {
+        "source": source_info,
+        "template": template_info["sha256"],
+        "config": settings_hash,
+        "outputs": [result["output"], result["supplemental"]],
+        "content_hash": result.get("content_hash"),
+        "metadata": result.get("metadata"),
+    }
+
+
+# (4.6) Tell a change to the body from a change to the header/footer or anchor tables only
+def hash_body_content(content, digest):
+    """Yield content unchanged while adding each block to digest, except the anchor tables (2.0)."""
+    for item in content:
+        item = as_record(item)
+        if not is_anchor_table(item):
+            digest.update(json.dumps(record_to_row(item)).encode('utf-8'))
+        yield item
+
+
+def finish_content_hash(source, digest):
+    """Add the figure images to digest once the content has been read, and return the body hash."""
+    for figure_number, images in list(source["figures"].items()) + [(None, source["unplaced_images"])]:
+        for image in images:
+            digest.update(repr((figure_number, image["cx"], image["cy"])).encode('utf-8'))
+            digest.update(bytes.fromhex(source_image_digest(source, image["rId"])))
+    return digest.hexdigest()
+
+
+def document_metadata(source):
+    """The header/footer information and anchor table rows of source, in the form stored in the manifest."""
+    return json.loads(json.dumps({"doc_information": source["doc_information"],
+                                  "anchor_tables": source["anchor_tables"]}))
+
+
+def can_update_in_place(entry, template_info, settings_hash):
+    """True if the entry's outputs exist and were built with this template and these settings, and the entry
+    records the body hash and metadata needed to patch them instead of converting again."""
+    return (
+        entry is not None
+        and entry.get("content_hash") is not None
+        and entry["template"] == template_info["sha256"]
+        and entry["config"] == settings_hash
+        and all(os.path.exists(path) for path in entry["outputs"] if path)
+    )
+
+
+
+
+# =============================== SECTION 5: Instrumentation =============================================
+# Purpose: Measure every pipeline stage of every document, check each output against its source, and write
+#          per-run reports.
+# Functions: 5.1 : run_stage
+#            5.2 : count_content
+#            5.3 : profile_call
+#            5.4 : write_run_report
+#            5.5 : fingerprint_content / fingerprint_document
+#            5.6 : verify_conversion / verify_output
+#            5.7 : write_verification_report
+#
+# Each stage entry records wall time, peak Python heap use during the stage (tracemalloc, only while
+# memory tracing is on) and the counts that apply to it. Memory held by lxml's C library is not traced.
+# Tracing slows every stage down, so it is turned on separately from the stage timings.
+# The verification fingerprints are short hashes, so checking an output costs one read of its body.
+
+# (5.1) Run one stage, recording it when a stages list is given
+def run_stage(stages, name, function, *args, **kwargs):
+    if stages is None:
+        return function(*args, **kwargs)
+
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+
+    result = function(*args, **kwargs)
+
+    stages.append({
+        "stage": name,
+        "seconds": round(time.perf_counter() - start, 6),
+        "peak_memory_bytes": tracemalloc.get_traced_memory()[1] if tracing else None,
+        "counts": {},
+    })
+    return result
+
+
+def add_stage_counts(stages, name, **counts):
+    """Attach counts to the most recent entry for stage `name`."""
+    if stages is None:
+        return
+    for stage in reversed(stages):
+        if stage["stage"] == name:
+            stage["counts"].update(counts)
+            return
+
+
+# (5.2) Count paragraphs, tables, runs and cells as content passes through to the writer
+def count_content(content, counts):
+    """Yield every item of content unchanged, tallying it in counts. Works for lists and streamed content."""
+    for key in ("paragraphs", "tables", "runs", "cells"):
+        counts.setdefault(key, 0)
+    for item in content:
+        item = as_record(item)
+        if item.type == "paragraph":
+            counts["paragraphs"] += 1
+            counts["runs"] += len(item.runs)
+        else:
+            counts["tables"] += 1
+            counts["cells"] += sum(len(row) for row in item.data)
+        yield item
+
+
+# (5.3) Optional profiler around one document
+def profile_call(profiler, profile_path, function, *args):
+    """Run function under cProfile ("cprofile") or pyinstrument ("pyinstrument") and save the profile.
+
+    cProfile output is a .prof file for pstats/snakeviz; pyinstrument output is an HTML page. pyinstrument
+    is optional and only imported when requested.
+    """
+    if profiler == "cprofile":
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(function, *args)
+        finally:
+            profile.dump_stats(profile_path + ".prof")
+
+    if profiler == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise ImportError("The pyinstrument profiler requires the pyinstrument package (pip install pyinstrument).")
+        profile = Profiler()
+        profile.start()
+        try:
+            return function(*args)
+        finally:
+            profile.stop()
+            with open(profile_path + ".html", 'w', encoding='utf-8') as f:
+                f.write(profile.output_html())
+
+    return function(*args)
+
+
+# (5.4) Write the per-run report
+def write_run_report(report_path, results, run_info):
+    """Save the batch results as JSON (one object per document) or, for a .csv path, one row per stage."""
+    if report_path.lower().endswith('.csv'):
+        count_keys = sorted({key for result in results for stage in result.get("stages") or [] for key in stage["counts"]})
+        with open(report_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(["run_started", "document", "success", "skipped", "stage", "seconds", "peak_memory_bytes"] + count_keys)
+            for result in results:
+                for stage in result.get("stages") or [{"stage": None, "seconds": None, "peak_memory_bytes": None, "counts": {}}]:
+                    writer.writerow([run_info["started"], result["document"], result["success"], result["skipped"],
+                                     stage["stage"], stage["seconds"], stage["peak_memory_bytes"]]
+                                    + [stage["counts"].get(key) for key in count_keys])
+    else:
+        documents = [
+            {key: result.get(key)
+             for key in ("document", "success", "skipped", "error", "output", "updated", "seconds", "stages")}
+            | {"verified": (result.get("verification") or {}).get("passed")}
+            for result in results
+        ]
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump({"run": run_info, "documents": documents}, f, indent=2)
+    print(f"Run report saved to {report_path}")
+
+
+# (5.5) Describe a body compactly enough to compare a source with its output
+def new_fingerprint():
+    """Empty fingerprint: a key and a short label per block, the "Figure N" caption numbers in order, and the
+    image hashes of each figure (None for images that no caption follows)."""
+    return {"blocks": [], "labels": [], "captions": [], "images": {}}
+
+
+def fingerprint_content(content, fingerprint):
+    """Yield content unchanged while adding each block to fingerprint.
+
+    A paragraph's key is a hash of its text; a table's key is its shape (rows, widest row) and a hash of its
+    cell text, leaving out the empty cells that end a row, as add_table_bulk (3.12) pads short rows with
+    them. Empty paragraphs are left out, since pictures are compared through the figures, and so are
+    the anchor tables, since their output copy is the template's (3.5).
+    """
+    for item in content:
+        item = as_record(item)
+        if item.type == "paragraph":
+            if item.text.strip():
+                fingerprint["blocks"].append(("p", 0, 0, short_hash(item.text)))
+                fingerprint["labels"].append(item.text[:60])
+                caption = FIGURE_CAPTION.match(item.text)
+                if caption:
+                    fingerprint["captions"].append(caption.group(1))
+        elif item.data and not is_anchor_table(item):
+            cell_text = "\n".join("\t".join(cell.text for cell in row).rstrip("\t") for row in item.data)
+            shape = (len(item.data), max(len(row) for row in item.data))
+            fingerprint["blocks"].append(("t", *shape, short_hash(cell_text)))
+            fingerprint["labels"].append(item.data[0][0].text[:60] if item.data[0] else "")
+        yield item
+
+
+def add_image_fingerprints(fingerprint, figure_images, image_digest):
+    """Add the figures of read_figure_images (2.8) to fingerprint; image_digest returns the SHA-256 (hex) of
+    the bytes of an rId."""
+    for figure_number, images in list(figure_images["figures"].items()) + [(None, figure_images["unplaced_images"])]:
+        if images:
+            fingerprint["images"].setdefault(figure_number, []).extend(image_digest(image["rId"]) for image in images)
+
+
+def fingerprint_document(doc):
+    """Fingerprint the body and figures of an open Document."""
+    fingerprint = new_fingerprint()
+    for _ in fingerprint_content(read_block_text(doc), fingerprint):
+        pass
+    add_image_fingerprints(fingerprint, read_figure_images(doc),
+                           lambda rId: hashlib.sha256(doc.part.related_parts[rId].blob).hexdigest())
+    return fingerprint
+
+
+def read_block_text(doc):
+    """Yield text-only content records for the body of doc: the text read_content_with_details (2.5) gives,
+    without the runs and styles that a fingerprint does not use.
+
+    Each table row is read from its w:tc elements rather than python-docx's cell grid. That gives the same
+    cells for tables written by add_table_bulk (3.12), which never merges cells.
+    """
+    for block in iter_block_items(doc.element.body, doc._body):
+        if isinstance(block, Paragraph):
+            yield ParagraphRecord(paragraph_element_text(block._p), None, False, ())
+        else:
+            yield TableRecord(tuple(
+                tuple(CellRecord(block_text(iter_block_items(tc, block)).strip(), None) for tc in tr.tc_lst)
+                for tr in block._tbl.tr_lst
+            ))
+
+
+def short_hash(data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+# (5.6) Check that every block, table and figure of the source reached the output
+def verify_conversion(source, output, template=None, exact_images=True):
+    """Compare the fingerprints of a source and its output and return a pass/fail report.
+
+    Each list of blocks is walked once. Blocks of template (the template's own body, which comes first in
+    the output) are set aside, then each source block takes the first unused output block with the same
+    key: a source block with none is missing, and one found before the block matched for its predecessor
+    is reordered. Output blocks left over are reported as added. Every figure must hold the same images,
+    or only the same number of them when images were recompressed (exact_images=False), and every caption
+    must still be present.
+    """
+    positions = {}
+    for position, key in enumerate(output["blocks"]):
+        positions.setdefault(key, deque()).append(position)
+    for key in template["blocks"] if template else []:
+        if positions.get(key):
+            positions[key].popleft()
+
+    missing, reordered = [], []
+    previous = -1
+    for index, key in enumerate(source["blocks"]):
+        candidates = positions.get(key)
+        if not candidates:
+            missing.append(block_report(source, index))
+            continue
+        position = candidates.popleft()
+        if position < previous:
+            reordered.append(block_report(source, index))
+        previous = position
+    left_over = {position for candidates in positions.values() for position in candidates}
+    added = [block_report(output, position) for position in range(len(output["blocks"])) if position in left_over]
+
+    # Template pictures come before the first caption of the output, so they are taken from its first figures
+    template_images = Counter(image for images in (template or {}).get("images", {}).values() for image in images)
+    output_images = {}
+    for figure_number, images in output["images"].items():
+        output_images[figure_number] = []
+        for image in images:
+            if template_images[image]:
+                template_images[image] -= 1
+            else:
+                output_images[figure_number].append(image)
+
+    images = []
+    extra_figures = [figure_number for figure_number in output_images if figure_number not in source["images"]]
+    for figure_number in list(source["images"]) + extra_figures:
+        expected = source["images"].get(figure_number, [])
+        found = output_images.get(figure_number, [])
+        if len(found) != len(expected):
+            images.append({"figure": figure_number, "expected": len(expected), "found": len(found),
+                           "reason": "missing" if len(found) < len(expected) else "extra"})
+        elif exact_images and found != expected:
+            images.append({"figure": figure_number, "expected": len(expected), "found": len(found),
+                           "reason": "changed"})
+
+    missing_captions = sorted((Counter(source["captions"]) - Counter(output["captions"])).elements(), key=int)
+
+    return {
+        "passed": not (missing or reordered or added or images or missing_captions),
+        "source_blocks": len(source["blocks"]),
+        "output_blocks": len(output["blocks"]),
+        "figures": len([number for number in source["images"] if number is not None]),
+        "missing": missing,
+        "reordered": reordered,
+        "added": added,
+        "images": images,
+        "missing_captions": missing_captions,
+    }
+
+
+def block_report(fingerprint, index):
+    kind, rows, columns, _ = fingerprint["blocks"][index]
+    if kind == "p":
+        return {"index": index, "type": "paragraph", "text": fingerprint["labels"][index]}
+    return {"index": index, "type": "table", "shape": [rows, columns], "text": fingerprint["labels"][index]}
+
+
+def verify_output(doc, source, source_fingerprint, template, exact_images=True):
+    """Verify the converted doc against the fingerprint taken of source's content as it was written.
+
+    The template's fingerprint is kept with the parsed template (3.10), so it is taken once per run.
+    """
+    add_image_fingerprints(source_fingerprint, source, lambda rId: source_image_digest(source, rId))
+    template_entry = load_template(template)
+    if "fingerprint" not in template_entry:
+        # Read a copy: wrapping the cached Document's body in python-docx objects would be carried into every
+        # later clone_template copy, detached from that copy's own body element
+        template_entry["fingerprint"] = fingerprint_document(clone_template(template))
+
+    report = verify_conversion(source_fingerprint, fingerprint_document(doc), template_entry["fingerprint"],
+                               exact_images)
+    if report["passed"]:
+        print(f"Verified: {report['source_blocks']} blocks and {report['figures']} figures present and in order")
+    else:
+        print(f"Verification FAILED: {len(report['missing'])} missing, {len(report['reordered'])} reordered, "
+              f"{len(report['added'])} added block(s), {len(report['images'])} figure(s) with wrong images, "
+              f"{len(report['missing_captions'])} missing caption(s)")
+    return report
+
+
+# (5.7) Write the pass/fail verification report
+def write_verification_report(report_path, results, run_info):
+    """Save each document's verification as JSON. passed is None for documents skipped as unchanged or not
+    verified, and False for documents that failed to convert."""
+    documents = []
+    for result in results:
+        verification = result.get("verification")
+        passed = verification["passed"] if verification else (False if not result["success"] else None)
+        documents.append({"document": result["document"], "passed": passed, "skipped": result["skipped"],
+                          "error": result.get("error"), "verification": verification})
+    checked = [document for document in documents if document["passed"] is not None]
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump({"run": run_info, "passed": all(document["passed"] for document in checked),
+                   "verified": len(checked), "failed": len([d for d in checked if not d["passed"]]),
+                   "documents": documents}, f, indent=2)
+    print(f"Verification report saved to {report_path}")
+
+
+
+
+#======================================= SECTION 6: Function Calls ============================================
+# Purpose: Convert one document through the library API, or every document in the source folder.
+# Functions: 6.1 : convert
+#            6.2 : process_document
+#            6.3 : convert_document_job
+#            6.4 : process_documents_in_folder
+#            6.5 : watch_folder
+#            6.6 : main
+#
+# Importing this file runs nothing. A long-running service imports it once and calls convert() per
+# document, so the imports and the parsed template (3.10) stay warm between conversions. The settings
+# below are only defaults; every function takes an options dictionary that overrides them.
 
 # Directory paths
 source_folder = 'Insert Non-Transferred Document Here'
 destination_folder = 'resources/template.docx'
 output_folder = 'Transferred Document Will Be Here'
-image_folder = 'resources/extracted_images'
+snapshot_folder = None  # Set to a folder path to save the output after every pipeline pass for debugging
+transfer_images_in_memory = True  # False = write images to a scratch folder and insert them by file name (3.8)
+stream_source_documents = False  # True = read the source body incrementally (2.9), for very large documents
+update_metadata_in_place = True  # False = convert changed documents in full even if only their metadata changed
+merge_adjacent_runs = True  # False = write every source run as-is instead of merging same-format runs (2.11)
+image_policy = None  # Set to {} (or override default_image_policy) to shrink images to their displayed size (3.13)
+verify_outputs = True  # False = do not check each output against its source after converting (5.6)
+
+
+def default_options():
+    """Return the conversion options, filled in from the settings above."""
+    return {
+        "source_folder": source_folder,
+        "template": destination_folder,
+        "output_folder": output_folder,
+        "snapshot_folder": snapshot_folder,
+        "transfer_images_in_memory": transfer_images_in_memory,
+        "stream": stream_source_documents,
+        "coalesce_runs": merge_adjacent_runs,
+        "metadata_updates": update_metadata_in_place,
+        "image_policy": image_policy,
+        "verify": verify_outputs,
+        "supplemental_tables": True,  # False = do not produce the supplemental tables document
+        "supplemental_table_filter": None,  # First cell texts of the tables to export (default: every table)
+        "name": None,  # Document name for the supplemental tables and snapshots (default: from source or output)
+        "stages": None,  # A list to measure every stage into (Section 5)
+    }
+
+
+# (6.1) Convert one document
+def convert(source, template=None, output=None, options=None):
+    """Convert the source document into the template and return a result dictionary.
+
+    source and template may each be a path, DOCX bytes or a binary file object; template defaults to
+    options["template"]. With an output path the document is saved there and the supplemental tables next
+    to it. Without one, nothing is written to disk and the result holds both documents as bytes:
+    {"output", "document_bytes", "supplemental", "supplemental_bytes", "images", "content_hash", "metadata",
+    "verification"}. content_hash and metadata are what update_metadata (6.2) compares a later version of the
+    source with; verification is the pass/fail report of verify_output (5.6), or None with options["verify"] off.
+    """
+    options = {**default_options(), **(options or {})}
+    template = docx_input(options["template"] if template is None else template)
+    if isinstance(template, io.BytesIO):
+        template = template.getvalue()  # Cached by content in load_template
+    stages = options["stages"]
+    name = options["name"] or next((value for value in (source, output) if isinstance(value, str)), "document.docx")
+    source_input = docx_input(source)
+
+    # Parse the source document once for every extraction step. In streaming mode the body is read
+    # incrementally while the writer consumes it, and the remaining entries are filled in along the way.
+    if options["stream"]:
+        source = run_stage(stages, "extract", stream_source_document, source_input)
+    else:
+        source = run_stage(stages, "extract", extract_source_document, source_input)
+
+    # Extract content from the source document, as compact records, hashing the body on the way (4.6)
+    body_digest = hashlib.sha256()
+    content = hash_body_content(source["content"], body_digest)
+    source_fingerprint = new_fingerprint()
+    if options["verify"]:
+        content = fingerprint_content(content, source_fingerprint)
+
+    # Write content with styles into the template
+    content_counts = {}
+    if stages is not None:
+        content = count_content(content, content_counts)
+    run_counts = {}
+    if options["coalesce_runs"]:
+        content = coalesce_runs(content, run_counts)
+    dest_doc = run_stage(stages, "write", build_document_with_existing_styles, content, template)
+    add_stage_counts(stages, "extract", **content_counts)  # A streamed source is actually read during "write"
+    add_stage_counts(stages, "write", **content_counts, **run_counts)
+    if run_counts:
+        print(f"Runs merged: {run_counts['runs_before']} -> {run_counts['runs_after']}")
+
+    # Extract document information; the anchor tables (Revision History, Approvals Table) were read with the source
+    doc_information = extract_document_information(source)
+
+    result = {"output": output, "document_bytes": None, "supplemental": None, "supplemental_bytes": None}
+
+    # Save tables into supplemental document, next to the output or as bytes
+    if options["supplemental_tables"]:
+        if output is not None:
+            result["supplemental"] = os.path.join(os.path.dirname(output), supplemental_name(name))
+        def export_tables():
+            supplemental_doc = build_supplemental_tables(source, options["supplemental_table_filter"])
+            return len(supplemental_doc.element.body.tbl_lst), save_document(supplemental_doc, result["supplemental"])
+
+        table_count, supplemental = run_stage(stages, "supplemental_tables", export_tables)
+        add_stage_counts(stages, "supplemental_tables", tables=table_count)
+        if output is None:
+            result["supplemental_bytes"] = supplemental
+        else:
+            print(f"Tables extracted and saved to {result['supplemental']}")
+
+    # Images go straight from the source package into the destination, or through a scratch folder
+    scratch_folder = None
+    if options["transfer_images_in_memory"]:
+        insert_images = lambda doc: apply_transferred_images(doc, source, image_policy=options["image_policy"])
+    else:
+        scratch_folder = tempfile.mkdtemp(prefix="extracted_images_")
+        extract_images_from_docx(source, scratch_folder)
+        insert_images = lambda doc: apply_images_by_filename(doc, scratch_folder, options["image_policy"])
+
+    # Apply every post-processing pass in memory and save once
+    destination = io.BytesIO() if output is None else output
+    try:
+        pass_results = run_destination_pipeline(dest_doc, [
+            ("approvals_revisions", lambda doc: apply_anchor_tables(doc, source["anchor_tables"])),
+            ("document_information", lambda doc: apply_document_information(doc, doc_information)),
+            ("caption_style", apply_caption_style),
+            ("images", insert_images),
+        ], destination, options["snapshot_folder"], stages, name)
+    finally:
+        if scratch_folder:
+            shutil.rmtree(scratch_folder, ignore_errors=True)
+    image_report = pass_results["images"]
+    add_stage_counts(stages, "images", images=len(image_report["inserted"]),
+                     unmatched_images=len(image_report["unmatched"]), source_image_bytes=image_report["source_bytes"],
+                     stored_image_bytes=image_report["stored_bytes"],
+                     image_bytes_saved=image_report["source_bytes"] - image_report["stored_bytes"])
+
+    if output is None:
+        result["document_bytes"] = destination.getvalue()
+    result["images"] = pass_results["images"]
+    result["content_hash"] = finish_content_hash(source, body_digest)
+    result["metadata"] = document_metadata(source)
+
+    # Check that every block and figure of the source reached the output
+    result["verification"] = None
+    if options["verify"]:
+        result["verification"] = run_stage(stages, "verify", verify_output, dest_doc, source, source_fingerprint,
+                                           template, options["image_policy"] is None)
+    return result
+
+
+def save_document(doc, path=None):
+    """Save doc to path and return the path, or return doc as DOCX bytes when no path is given."""
+    if path is not None:
+        save_atomically(doc, path)
+        return path
+    stream = io.BytesIO()
+    doc.save(stream)
+    return stream.getvalue()
+
+
+# (6.2) Convert a single document from the source folder
+def process_document(docx_file, options=None, previous=None):
+    """Convert one document from options["source_folder"] into options["output_folder"].
+
+    previous is the document's manifest entry when its existing output may only need its metadata patched
+    (see update_metadata); the document is converted in full if its body has changed. If options["stages"]
+    is a list, every stage is measured into it (Section 5).
+    """
+    options = {**default_options(), **(options or {})}
+    source_doc_path = os.path.join(options["source_folder"], docx_file)
+
+    # Define the output path with the same name as the source file
+    finished_good = os.path.join(options["output_folder"], docx_file)
+
+    if previous is not None and options["metadata_updates"]:
+        result = update_metadata(source_doc_path, finished_good, previous, options)
+        if result is not None:
+            print(f"Updated {docx_file}: {', '.join(result['updated']) or 'metadata already current'}")
+            return {key: result[key] for key in ("output", "supplemental", "images", "content_hash", "metadata",
+                                                 "verification", "updated")}
+        print(f"{docx_file}: body changed, converting in full")
+
+    result = convert(source_doc_path, options["template"], finished_good, options)
+    print(f"Processed {docx_file} and saved to {finished_good}")
+    return {"output": result["output"], "supplemental": result["supplemental"], "images": result["images"],
+            "content_hash": result["content_hash"], "metadata": result["metadata"],
+            "verification": result["verification"], "updated": None}
+
+
+def update_metadata(source, output, previous, options=None):
+    """Patch the header/footer information and anchor tables of source into the existing output, leaving the
+    body and images alone.
+
+    previous is the manifest entry (Section 4) of the conversion that produced output. Only the parts whose
+    extracted data differs from what previous records are re-applied, with the same passes as convert(), and
+    the supplemental tables are rebuilt if an anchor table changed. Returns a result like convert()'s, with
+    "updated" listing the patched parts, or None if the body changed and the document must be converted.
+    With options["verify"] on, the output is checked against the source (5.6) whether or not it was patched.
+    """
+    options = {**default_options(), **(options or {})}
+    stages = options["stages"]
+    extract = stream_source_document if options["stream"] else extract_source_document
+    source = run_stage(stages, "extract", extract, docx_input(source))
+
+    body_digest = hashlib.sha256()
+    source_fingerprint = new_fingerprint()
+    content = hash_body_content(source["content"], body_digest)
+    for _ in fingerprint_content(content, source_fingerprint) if options["verify"] else content:
+        pass
+    content_hash = finish_content_hash(source, body_digest)
+    if content_hash != previous["content_hash"]:
+        return None
+
+    metadata = document_metadata(source)
+    passes = []
+    if metadata["doc_information"] != previous["metadata"]["doc_information"]:
+        passes.append(("document_information", lambda doc: apply_document_information(doc, source["doc_information"])))
+    if metadata["anchor_tables"] != previous["metadata"]["anchor_tables"]:
+        template_doc = load_template(options["template"])["document"]
+        passes.append(("approvals_revisions",
+                       lambda doc: apply_anchor_tables(doc, source["anchor_tables"], template_doc)))
+
+    result = {"output": output, "supplemental": previous["outputs"][1], "images": None,
+              "content_hash": content_hash, "metadata": metadata, "verification": None,
+              "updated": [name for name, _ in passes]}
+    if passes or options["verify"]:
+        doc = run_stage(stages, "open_output", Document, output)
+    if passes:
+        run_destination_pipeline(doc, passes, output, options["snapshot_folder"], stages, options["name"])
+    if "approvals_revisions" in result["updated"] and result["supplemental"]:
+        run_stage(stages, "supplemental_tables", lambda: save_document(
+            build_supplemental_tables(source, options["supplemental_table_filter"]), result["supplemental"]))
+    if options["verify"]:
+        result["verification"] = run_stage(stages, "verify", verify_output, doc, source, source_fingerprint,
+                                           options["template"], options["image_policy"] is None)
+    return result
+
+
+# (6.3) Convert one document and report the outcome instead of raising
+def convert_document_job(docx_file, previous=None, instrument=False, profiler=None, profile_folder=None,
+                         options=None, trace_memory=False):
+    """Convert (or, given its previous manifest entry, update) one document and return its result record.
+
+    With instrument=True the record includes per-stage measurements ("stages"). trace_memory=True also
+    traces memory while the document converts, for each stage's peak; tracing slows every stage down, so
+    leave it off when the stage times matter. With a profiler ("cprofile" or "pyinstrument") a profile is
+    saved per document in profile_folder. options is passed on to process_document; it must be picklable
+    for worker processes.
+    """
+    stages = [] if instrument else None
+    options = {**(options or {}), "stages": stages}
+    started_tracing = instrument and trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        if profiler:
+            os.makedirs(profile_folder, exist_ok=True)
+            profile_path = os.path.join(profile_folder, os.path.splitext(docx_file)[0])
+            outcome = profile_call(profiler, profile_path, process_document, docx_file, options, previous)
+        else:
+            outcome = process_document(docx_file, options, previous)
+        return {"document": docx_file, "success": True, "skipped": False, "error": None,
+                "seconds": round(time.perf_counter() - start, 6), "stages": stages, **outcome}
+    except Exception as e:
+        print(f"Error processing {docx_file}: {e}")
+        return failed_job_result(docx_file, e, round(time.perf_counter() - start, 6), stages)
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+
+
+def failed_job_result(docx_file, error, seconds=None, stages=None):
+    """Result record of a document whose conversion raised error, or whose worker process died."""
+    return {"document": docx_file, "success": False, "skipped": False, "output": None, "supplemental": None,
+            "images": None, "content_hash": None, "metadata": None, "verification": None, "updated": None,
+            "error": f"{type(error).__name__}: {error}", "seconds": seconds, "stages": stages}
+
+
+# (6.4) Process each document in the source folder
+def is_source_document(file_name):
+    """True for a DOCX to convert; False for Office lock files (~$name.docx), temporary and hidden files."""
+    return (file_name.lower().endswith('.docx')
+            and not file_name.startswith(('~', '.')))
+
+
+def process_documents_in_folder(workers=1, force=False, report_path=None, profiler=None, profile_folder=None,
+                                options=None, verification_report_path=None, trace_memory=False):
+    """Convert every DOCX in the source folder, using up to `workers` processes (one document per process;
+    0 = one per CPU core).
+
+    Each document gets a private image folder, and a failure in one document, including one that kills its
+    worker process, is recorded in the returned results without stopping the rest of the batch. Documents
+    whose source, template and settings match the manifest (Section 4) are skipped unless force is True.
+    With report_path, every stage is measured and the run report is written there as JSON or CSV
+    (Section 5); trace_memory adds each stage's peak traced memory to it. profiler saves a profile per
+    document.
+    With verification_report_path, the pass/fail verification of every document is saved there (5.7).
+    options overrides default_options(), including the source, template and output paths.
+    """
+    run_started = time.time()
+    workers = workers or os.cpu_count()
+    options = {**default_options(), **(options or {})}
+    source_folder = options["source_folder"]
+    destination_folder = options["template"]
+    output_folder = options["output_folder"]
 
-# Function to process each document in the source folder
-def process_documents_in_folder():
     # Get all DOCX files in the source folder
-    docx_files = [f for f in os.listdir(source_folder) if f.lower().endswith('.docx')]
+    docx_files = [f for f in os.listdir(source_folder) if is_source_document(f)]
+
+    # Parse the template and validate style_mapping up front, so a bad template fails once, not per document
+    load_template(destination_folder)
 
+    # Compare each source against the manifest from the previous run
+    manifest = load_manifest(output_folder)
+    entries = manifest["documents"]
+    template_info = file_hash(destination_folder, manifest.get("template"))
+    settings_hash = config_hash(options)
+
+    source_infos = {}
+    results = []
+    to_convert = []
+    previous_entries = []  # Manifest entry of each document in to_convert whose output may only need its metadata patched
     for docx_file in docx_files:
-        source_doc_path = os.path.join(source_folder, docx_file)
-        
-        # Define the output path with the same name as the source file
-        finished_good = os.path.join(output_folder, docx_file)
-
-        # Extract Revision History
-        revision_history = extract_revision_text(source_doc_path)
-
-        # Save tables into supplemental document
-        extract_and_copy_tables(source_doc_path, output_folder)
-        
-        # Extract Approvals Table
-        approvals = extract_approval_text(source_doc_path)
-        
-        # Extract content from the source document
-        content = extract_content_with_details(source_doc_path)
-        
-        # Extract document information
-        doc_information = extract_document_information(source_doc_path)
-        
-        # Write content with styles to destination document
-        write_content_with_existing_styles(content, destination_folder, finished_good)
-
-        # Input revision and approvals
-        input_approvals_revisions_text(finished_good, revision_history, approvals)
-
-        # Input document information
-        input_document_information(finished_good, doc_information)
-
-        # Italicize and resize caption style
-        italicize_and_resize_caption_style(finished_good)
-
-        # Extract images from source DOCX
-        extract_images_from_docx(source_doc_path, image_folder)
-
-        # Insert images into the destination document
-        insert_images_by_filename(finished_good, image_folder)
-
-        print(f"Processed {docx_file} and saved to {finished_good}")
+        entry = entries.get(docx_file)
+        source_infos[docx_file] = file_hash(os.path.join(source_folder, docx_file), entry and entry["source"])
+        if not force and is_up_to_date(entry, source_infos[docx_file], template_info, settings_hash):
+            entry["source"] = source_infos[docx_file]  # Keep the latest mtime so the next run skips hashing
+            results.append({"document": docx_file, "success": True, "skipped": True, "output": entry["outputs"][0],
+                            "supplemental": entry["outputs"][1], "images": None, "verification": None,
+                            "error": None})
+        else:
+            to_convert.append(docx_file)
+            previous_entries.append(entry if not force and can_update_in_place(entry, template_info, settings_hash)
+                                    else None)
+
+    job = functools.partial(convert_document_job, instrument=report_path is not None, trace_memory=trace_memory,
+                            profiler=profiler, profile_folder=profile_folder or output_folder, options=options)
+    if workers == 1 or len(to_convert) <= 1:
+        results += [job(docx_file, previous) for docx_file, previous in zip(to_convert, previous_entries)]
+    else:
+        results += convert_in_processes(job, to_convert, previous_entries, workers)
+
+    # Record successful conversions and prune entries for sources that no longer exist
+    for result in results:
+        if result["success"] and not result["skipped"]:
+            entries[result["document"]] = manifest_entry(source_infos[result["document"]], template_info,
+                                                         settings_hash, result)
+    for docx_file in set(entries) - set(docx_files):
+        del entries[docx_file]
+    manifest["template"] = template_info
+    save_manifest(output_folder, manifest)
+
+    # Per-document summary
+    succeeded = [result for result in results if result["success"] and not result["skipped"]]
+    skipped = [result for result in results if result["skipped"]]
+    updated = [result for result in succeeded if result.get("updated") is not None]
+    unverified = [result for result in succeeded if result.get("verification") and not result["verification"]["passed"]]
+    print(f"Converted {len(succeeded)} of {len(results)} documents ({len(updated)} by updating metadata only, "
+          f"{len(skipped)} unchanged and skipped).")
+    for result in results:
+        if not result["success"]:
+            print(f"FAILED {result['document']}: {result['error']}")
+        elif result.get("verification") and not result["verification"]["passed"]:
+            print(f"FAILED verification {result['document']}: content missing or out of order in the output")
+        elif result["images"] and result["images"]["unmatched"]:
+            print(f"{result['document']}: {len(result['images']['unmatched'])} image(s) not placed")
+
+    run_info = {
+        "started": datetime.fromtimestamp(run_started, timezone.utc).isoformat(),
+        "seconds": round(time.time() - run_started, 6),
+        "workers": workers,
+        "documents": len(results),
+        "converted": len(succeeded),
+        "updated": len(updated),
+        "skipped": len(skipped),
+        "failed": len(results) - len(succeeded) - len(skipped),
+        "failed_verification": len(unverified),
+    }
+    if report_path:
+        write_run_report(report_path, results, run_info)
+    if verification_report_path:
+        write_verification_report(verification_report_path, results, run_info)
+
+    return results
+
+
+def convert_in_processes(job, docx_files, previous_entries, workers):
+    """Run job(docx_file, previous) for each document in up to `workers` processes; return the results in order.
+
+    A worker process that dies (killed for running out of memory, or a crash inside lxml) breaks the whole
+    pool, and every document it had not finished raises BrokenProcessPool. Those documents are converted
+    again one at a time, each in a fresh single-worker pool, so only a document that kills its own worker is
+    recorded as failed.
+    """
+    results = {}
+    broken = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(job, docx_file, previous): (docx_file, previous)
+                   for docx_file, previous in zip(docx_files, previous_entries)}
+        for future in as_completed(futures):
+            try:
+                results[futures[future][0]] = future.result()
+            except BrokenProcessPool:
+                broken.append(futures[future])
+
+    if broken:
+        print(f"A worker process died; converting {len(broken)} unfinished document(s) again one at a time.")
+    for docx_file, previous in sorted(broken, key=lambda job_info: docx_files.index(job_info[0])):
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            try:
+                results[docx_file] = executor.submit(job, docx_file, previous).result()
+            except BrokenProcessPool as e:
+                print(f"Error processing {docx_file}: its worker process died")
+                results[docx_file] = failed_job_result(docx_file, e)
+
+    return [results[docx_file] for docx_file in docx_files]
+
+
+# (6.5) Convert documents as they arrive in the source folder
+def scan_source_folder(folder):
+    """Return {file name: (size, modification time)} for every source document in folder."""
+    signatures = {}
+    for entry in os.scandir(folder):
+        if not is_source_document(entry.name):
+            continue
+        try:
+            if entry.is_file():
+                stat = entry.stat()
+                signatures[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            pass  # Removed between listing and stat
+    return signatures
+
+
+def watch_folder(workers=1, poll_interval=1.0, settle_seconds=2.0, queue_size=None, options=None, stop=None):
+    """Poll the source folder and convert documents that are new or have changed, until interrupted.
+
+    A document is converted once its size and modification time have not changed for settle_seconds, so
+    files that are still being copied or saved are left alone. At most queue_size conversions (default two
+    per worker) are handed to the worker processes at once; other settled documents wait for the next free
+    slot. The manifest (Section 4) is updated after every conversion, so documents that are already
+    converted are skipped, including after a restart. A document that fails is retried only when it changes;
+    that includes a document whose worker process dies, after which the pool of workers is replaced.
+    workers=0 starts one per CPU core. stop is an optional threading.Event for callers that run the watcher in a thread.
+    Returns the result records of every conversion.
+    """
+    workers = workers or os.cpu_count()
+    options = {**default_options(), **(options or {})}
+    source_folder = options["source_folder"]
+    output_folder = options["output_folder"]
+    queue_size = queue_size or 2 * workers
+    os.makedirs(output_folder, exist_ok=True)
+    load_template(options["template"])
+
+    manifest = load_manifest(output_folder)
+    entries = manifest["documents"]
+    settings_hash = config_hash(options)
+    job = functools.partial(convert_document_job, options=options)
+
+    seen = {}  # File name -> (signature, when that signature was first seen)
+    handled = {}  # File name -> signature that was last converted, skipped or failed
+    running = {}  # Future -> (file name, signature, source hash, template hash, executor it was submitted to)
+    results = []
+
+    print(f"Watching {source_folder} for documents (Ctrl+C to stop).")
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        while not (stop and stop.is_set()):
+            # Record finished conversions
+            for future in [future for future in running if future.done()]:
+                docx_file, signature, source_info, template_info, pool = running.pop(future)
+                try:
+                    result = future.result()
+                except BrokenProcessPool as e:
+                    # A worker died and took every conversion in its pool with it; later ones need a new pool
+                    print(f"Error processing {docx_file}: its worker process died")
+                    result = failed_job_result(docx_file, e)
+                    if pool is executor:
+                        executor.shutdown(wait=False)
+                        executor = ProcessPoolExecutor(max_workers=workers)
+                results.append(result)
+                handled[docx_file] = signature
+                if result["success"]:
+                    entries[docx_file] = manifest_entry(source_info, template_info, settings_hash, result)
+                    save_manifest(output_folder, manifest)
+                    print(f"Converted {docx_file} in {result['seconds']:.2f} s")
+                    if result["verification"] and not result["verification"]["passed"]:
+                        print(f"FAILED verification {docx_file}: content missing or out of order in the output")
+                else:
+                    print(f"FAILED {docx_file}: {result['error']}")
+
+            now = time.monotonic()
+            signatures = scan_source_folder(source_folder)
+            for docx_file in set(seen) - set(signatures):
+                del seen[docx_file]
+                handled.pop(docx_file, None)
+            for docx_file, signature in signatures.items():
+                if docx_file not in seen or seen[docx_file][0] != signature:
+                    seen[docx_file] = (signature, now)
+
+            # A changed template makes every document out of date
+            template_info = file_hash(options["template"], manifest.get("template"))
+            if template_info["sha256"] != (manifest.get("template") or {}).get("sha256"):
+                manifest["template"] = template_info
+                handled.clear()
+
+            in_progress = {job_info[0] for job_info in running.values()}
+            settled = sorted((first_seen, docx_file) for docx_file, (signature, first_seen) in seen.items()
+                             if now - first_seen >= settle_seconds and handled.get(docx_file) != signature
+                             and docx_file not in in_progress)
+            for _, docx_file in settled:
+                if len(running) >= queue_size:
+                    break
+                signature = seen[docx_file][0]
+                entry = entries.get(docx_file)
+                try:
+                    source_info = file_hash(os.path.join(source_folder, docx_file), entry and entry["source"])
+                except FileNotFoundError:
+                    continue
+                if is_up_to_date(entry, source_info, template_info, settings_hash):
+                    entry["source"] = source_info
+                    handled[docx_file] = signature
+                    continue
+                previous = entry if can_update_in_place(entry, template_info, settings_hash) else None
+                print(f"Queued {docx_file}")
+                running[executor.submit(job, docx_file, previous)] = (docx_file, signature, source_info, template_info,
+                                                                      executor)
+
+            if running:
+                wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            elif stop:
+                stop.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        print("Stopping; waiting for conversions in progress.")
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    return results
+
+
+# (6.6) Command line entry point
+def main(argv=None):
+    """Convert the documents named on the command line, or every document in the source folder."""
+    parser = argparse.ArgumentParser(description="Transfer documents into the standard template.")
+    parser.add_argument("documents", nargs="*", metavar="DOCX",
+                        help="documents to convert (default: every document in the source folder)")
+    parser.add_argument("--template", default=destination_folder, help="template to transfer into")
+    parser.add_argument("--source-folder", default=source_folder, help="folder of documents to convert")
+    parser.add_argument("--output-folder", default=output_folder, help="where converted documents are saved")
+    parser.add_argument("--stream", action="store_true", default=stream_source_documents,
+                        help="read each source body incrementally, for very large documents")
+    parser.add_argument("--keep-runs", action="store_true",
+                        help="write every source run as-is instead of merging adjacent runs with the same formatting")
+    parser.add_argument("--supplemental-table", action="append", metavar="TEXT",
+                        help="export only the tables whose first cell reads TEXT to the supplemental document "
+                             "(repeatable; default: every table)")
+    parser.add_argument("--image-dpi", type=int, metavar="DPI",
+                        help="shrink and recompress images to this resolution at their displayed size")
+    parser.add_argument("--no-verify", action="store_true",
+                        help="do not check each output for missing or reordered content after converting")
+    parser.add_argument("--verify-report", metavar="PATH",
+                        help="write the pass/fail verification of every document as JSON")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running and convert documents as they are added to or changed in the source folder")
+    parser.add_argument("--poll-interval", type=float, default=1.0, metavar="SECONDS",
+                        help="how often --watch checks the source folder")
+    parser.add_argument("--settle", type=float, default=2.0, metavar="SECONDS",
+                        help="how long a document must be unchanged before --watch converts it")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of documents to convert in parallel (0 = one per CPU core)")
+    parser.add_argument("--force", action="store_true",
+                        help="convert every document, even if it is unchanged since the last run")
+    parser.add_argument("--report", metavar="PATH",
+                        help="measure every stage and write a run report (.json, or .csv for one row per stage)")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="with --report, also record each stage's peak traced memory (slows every stage down)")
+    parser.add_argument("--profile", choices=["cprofile", "pyinstrument"],
+                        help="save a profile of each converted document")
+    parser.add_argument("--profile-folder", metavar="FOLDER",
+                        help="where profiles are saved (default: the output folder)")
+    args = parser.parse_args(argv)
+
+    options = {"template": args.template, "source_folder": args.source_folder, "output_folder": args.output_folder,
+               "stream": args.stream, "supplemental_table_filter": args.supplemental_table,
+               "coalesce_runs": merge_adjacent_runs and not args.keep_runs,
+               "verify": verify_outputs and not args.no_verify}
+    if args.image_dpi:
+        options["image_policy"] = {"dpi": args.image_dpi}
+
+    if args.watch:
+        watch_folder(workers=args.workers, poll_interval=args.poll_interval,
+                     settle_seconds=args.settle, options=options)
+        return 0
+
+    if not args.documents:
+        results = process_documents_in_folder(workers=args.workers, force=args.force,
+                                              report_path=args.report, profiler=args.profile,
+                                              profile_folder=args.profile_folder, options=options,
+                                              verification_report_path=args.verify_report,
+                                              trace_memory=args.trace_memory)
+        return 0 if all(result["success"] and (result.get("verification") or {}).get("passed", True)
+                        for result in results) else 1
+
+    os.makedirs(args.output_folder, exist_ok=True)
+    failed = 0
+    results = []
+    for path in args.documents:
+        try:
+            result = convert(path, args.template, os.path.join(args.output_folder, os.path.basename(path)), options)
+            print(f"Processed {path}")
+            results.append({"document": path, "success": True, "skipped": False, "error": None,
+                            "verification": result["verification"]})
+            if result["verification"] and not result["verification"]["passed"]:
+                failed += 1
+        except Exception as e:
+            print(f"Error processing {path}: {e}")
+            results.append({"document": path, "success": False, "skipped": False, "error": f"{type(e).__name__}: {e}",
+                            "verification": None})
+            failed += 1
+    if args.verify_report:
+        write_verification_report(args.verify_report, results, {"documents": len(results), "failed": failed})
+    return 1 if failed else 0
+
 
 # Call the function to process the documents
-process_documents_in_folder()
+if __name__ == "__main__":
+    sys.exit(main())
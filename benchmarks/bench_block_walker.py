@@ -0,0 +1,55 @@
+# Benchmark: scaling of the body block walker used by extract_content_with_details
+# Purpose: Build synthetic documents of increasing size and time read_content_with_details on each one.
+#          Time per block should stay roughly constant as the document grows (linear scaling).
+#
+# Usage: python benchmarks/bench_block_walker.py [paragraph counts...]
+
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from docx import Document
+
+from DocTransfer import read_content_with_details
+
+
+def build_document(paragraph_count):
+    """Create an in-memory DOCX with paragraph_count paragraphs and a small table every 50 paragraphs."""
+    doc = Document()
+    for index in range(paragraph_count):
+        paragraph = doc.add_paragraph(f"Step {index}: ")
+        paragraph.add_run("check the label").bold = True
+        paragraph.add_run(" and confirm the fitment.")
+        if index % 50 == 49:
+            table = doc.add_table(rows=3, cols=3)
+            for row in table.rows:
+                for cell in row.cells:
+                    cell.text = f"Cell {index}"
+
+    stream = io.BytesIO()
+    doc.save(stream)
+    stream.seek(0)
+    return Document(stream)
+
+
+def main(sizes):
+    print(f"{'paragraphs':>10} {'blocks':>8} {'seconds':>9} {'us/block':>9}")
+    per_block = []
+    for size in sizes:
+        doc = build_document(size)
+        start = time.perf_counter()
+        content = read_content_with_details(doc)
+        elapsed = time.perf_counter() - start
+        per_block.append(elapsed / len(content) * 1e6)
+        print(f"{size:>10} {len(content):>8} {elapsed:>9.3f} {per_block[-1]:>9.1f}")
+
+    # For linear scaling the cost per block stays flat; quadratic scaling grows with the size ratio
+    growth = per_block[-1] / per_block[0]
+    print(f"Cost per block grew {growth:.2f}x while size grew {sizes[-1] / sizes[0]:.0f}x")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [500, 1000, 2000, 4000, 8000])
@@ -0,0 +1,72 @@
+# Benchmark: peak memory of full-tree extraction vs streaming extraction
+# Purpose: Build one large synthetic document and compare the peak resident memory of
+#          extract_source_document (whole python-docx tree) against stream_source_document, each consumed
+#          the way convert() consumes it: every body block, then the tables for the supplemental document.
+#          Building and each measurement run in separate processes, since Linux carries the peak RSS of a
+#          parent over into its children.
+#
+# Usage: python benchmarks/bench_streaming_memory.py [paragraph count] [rows per table]
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from docx import Document
+
+from DocTransfer import extract_source_document, stream_source_document
+
+
+def build_document(path, paragraph_count, table_rows):
+    """Save a DOCX with paragraph_count fragmented paragraphs and a table_rows-row table every 100 paragraphs."""
+    doc = Document()
+    for index in range(paragraph_count):
+        paragraph = doc.add_paragraph()
+        for word in f"Step {index} check the label and confirm the fitment".split():
+            paragraph.add_run(word + " ")
+        if index % 100 == 99:
+            table = doc.add_table(rows=table_rows, cols=4)
+            for row in table.rows:
+                for cell in row.cells:
+                    cell.text = f"Part {index}"
+    doc.save(path)
+
+
+def peak_memory_mib():
+    """Peak resident set size of this process in MiB (ru_maxrss is KiB on Linux, bytes on macOS)."""
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def measure(mode, path):
+    start = time.perf_counter()
+    source = extract_source_document(path) if mode == "full" else stream_source_document(path)
+    blocks = sum(1 for _ in source["content"])
+    tables = sum(1 for _ in source["tables"])
+    elapsed = time.perf_counter() - start
+    print(f"{mode:<10} {blocks:>8} blocks {tables:>5} tables {elapsed:>8.2f} s {peak_memory_mib():>9.1f} MiB peak RSS")
+
+
+def main(paragraph_count, table_rows):
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "large.docx")
+        subprocess.run([sys.executable, os.path.abspath(__file__), "--build", str(paragraph_count), str(table_rows),
+                        path], check=True)
+        print(f"{paragraph_count} paragraphs, {table_rows}-row tables, "
+              f"{os.path.getsize(path) / 2 ** 20:.1f} MiB on disk")
+
+        for mode in ("full", "streaming"):
+            subprocess.run([sys.executable, os.path.abspath(__file__), "--measure", mode, path], check=True)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--build"]:
+        build_document(sys.argv[4], int(sys.argv[2]), int(sys.argv[3]))
+    elif sys.argv[1:2] == ["--measure"]:
+        measure(sys.argv[2], sys.argv[3])
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000, int(sys.argv[2]) if len(sys.argv) > 2 else 20)
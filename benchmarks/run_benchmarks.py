@@ -0,0 +1,181 @@
+# Benchmark suite for the full conversion pipeline
+# Purpose: Convert synthetic documents of controlled size (see synthetic.py) and time the whole pipeline and
+#          each stage, then save the results under benchmarks/results so runs can be compared across commits.
+#
+# Usage: python benchmarks/run_benchmarks.py                      run every scenario
+#        python benchmarks/run_benchmarks.py -s tables -s images  run selected scenarios
+#        python benchmarks/run_benchmarks.py --template resources/template.docx
+#        python benchmarks/run_benchmarks.py --compare OLD.json NEW.json
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+BENCHMARK_FOLDER = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_FOLDER, os.pardir))
+
+import docx
+
+import DocTransfer
+from synthetic import make_source_document, make_template
+
+RESULTS_FOLDER = os.path.join(BENCHMARK_FOLDER, "results")
+
+# Each scenario grows one axis from the baseline document
+BASELINE = {"paragraphs": 200, "tables": 2, "table_rows": 10, "table_columns": 4, "runs_per_paragraph": 3,
+            "images": 2, "image_size": (200, 150), "header_tables": True, "table_images": False}
+SCENARIOS = {
+    "baseline": {},
+    "paragraphs": {"paragraphs": 5000},
+    "tables": {"tables": 20, "table_rows": 200},
+    "fragmented_runs": {"paragraphs": 1000, "runs_per_paragraph": 40},
+    "images": {"images": 40},
+    "large_images": {"images": 5, "image_size": (2400, 1800)},
+    "no_header_tables": {"header_tables": False},
+    "table_images": {"images": 10, "table_images": True},
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARK_FOLDER, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_scenario(name, params, template_path, workspace, repeat, measure_memory):
+    """Convert the scenario's document `repeat` times and return the median time of each stage."""
+    source_folder = os.path.join(workspace, name, "source")
+    output_folder = os.path.join(workspace, name, "output")
+    os.makedirs(source_folder)
+    os.makedirs(output_folder)
+    make_source_document(os.path.join(source_folder, f"{name}.docx"), **params)
+
+    options = {"source_folder": source_folder, "output_folder": output_folder, "template": template_path}
+    DocTransfer.load_template(template_path)  # Template parsing is once per run, not per document
+
+    runs = []
+    for _ in range(repeat):
+        result = DocTransfer.convert_document_job(f"{name}.docx", instrument=True, options=options)
+        if not result["success"]:
+            raise RuntimeError(f"Scenario {name} failed: {result['error']}")
+        if result["verification"] and not result["verification"]["passed"]:
+            raise RuntimeError(f"Scenario {name} failed verification: {result['verification']}")
+        if len(result["images"]["inserted"]) != params["images"]:
+            raise RuntimeError(f"Scenario {name} inserted {len(result['images']['inserted'])} of "
+                               f"{params['images']} images: {result['images']['unmatched']}")
+        runs.append(result)
+
+    stage_names = [stage["stage"] for stage in runs[0]["stages"]]
+    summary = {
+        "params": params,
+        "source_bytes": os.path.getsize(os.path.join(source_folder, f"{name}.docx")),
+        "output_bytes": os.path.getsize(runs[0]["output"]),
+        "total_seconds": statistics.median(run["seconds"] for run in runs),
+        "stages": {
+            stage: statistics.median(run["stages"][index]["seconds"] for run in runs)
+            for index, stage in enumerate(stage_names)
+        },
+        "counts": {stage["stage"]: stage["counts"] for stage in runs[0]["stages"] if stage["counts"]},
+    }
+
+    # Memory tracing slows every stage down, so the timed runs above do not trace and peak memory comes
+    # from one extra, separate run
+    if measure_memory:
+        result = DocTransfer.convert_document_job(f"{name}.docx", instrument=True, options=options,
+                                                  trace_memory=True)
+        summary["peak_memory_bytes"] = {stage["stage"]: stage["peak_memory_bytes"] for stage in result["stages"]}
+
+    return summary
+
+
+def run_suite(scenarios, template_path, repeat, measure_memory):
+    workspace = tempfile.mkdtemp(prefix="doctransfer_bench_")
+    try:
+        if template_path is None:
+            template_path = os.path.join(workspace, "template.docx")
+            make_template(template_path)
+
+        results = {}
+        for name in scenarios:
+            params = dict(BASELINE, **SCENARIOS[name])
+            print(f"Running {name} ...", flush=True)
+            results[name] = run_scenario(name, params, template_path, workspace, repeat, measure_memory)
+            print(f"  {name}: {results[name]['total_seconds']:.3f} s", flush=True)
+        return results
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+
+def save_results(results, repeat, template_path):
+    os.makedirs(RESULTS_FOLDER, exist_ok=True)
+    commit = git_commit()
+    started = datetime.now(timezone.utc)
+    path = os.path.join(RESULTS_FOLDER, f"{started:%Y%m%dT%H%M%SZ}_{commit}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "commit": commit,
+            "date": started.isoformat(),
+            "python": platform.python_version(),
+            "python_docx": getattr(docx, "__version__", "unknown"),
+            "machine": platform.platform(),
+            "repeat": repeat,
+            "template": template_path or "synthetic",
+            "scenarios": results,
+        }, f, indent=2)
+    print(f"Results saved to {path}")
+    return path
+
+
+def compare(old_path, new_path):
+    """Print each scenario's total and per-stage times side by side, with the new/old ratio."""
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+
+    print(f"{'scenario / stage':<36} {old['commit']:>12} {new['commit']:>12} {'ratio':>7}")
+    for name, new_scenario in new["scenarios"].items():
+        old_scenario = old["scenarios"].get(name)
+        if old_scenario is None:
+            continue
+        rows = [("total", old_scenario["total_seconds"], new_scenario["total_seconds"])]
+        rows += [(stage, old_scenario["stages"].get(stage), seconds) for stage, seconds in new_scenario["stages"].items()]
+        for label, old_seconds, new_seconds in rows:
+            ratio = f"{new_seconds / old_seconds:.2f}" if old_seconds else "-"
+            old_text = f"{old_seconds:.4f}" if old_seconds is not None else "-"
+            title = name if label == "total" else f"  {label}"
+            print(f"{title:<36} {old_text:>12} {new_seconds:>12.4f} {ratio:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the DocTransfer pipeline on synthetic documents.")
+    parser.add_argument("-s", "--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run (repeatable; default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="conversions per scenario; the median is kept")
+    parser.add_argument("--template", help="template to convert into (default: a generated synthetic template)")
+    parser.add_argument("--memory", action="store_true", help="also record peak traced memory per stage")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two saved result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    start = time.perf_counter()
+    results = run_suite(args.scenario or list(SCENARIOS), args.template, args.repeat, args.memory)
+    save_results(results, args.repeat, args.template)
+    print(f"Suite finished in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
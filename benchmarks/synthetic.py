@@ -0,0 +1,114 @@
+# Synthetic documents for the benchmarks
+# Purpose: Generate source documents of controlled size, and a template with the styles and tables that
+#          DocTransfer.py expects, so benchmarks do not depend on real (confidential) procedures.
+# Functions: make_template
+#            make_source_document
+
+import io
+import random
+
+from docx import Document
+from docx.enum.style import WD_STYLE_TYPE
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls
+from docx.shared import Inches
+
+# Paragraph styles used by style_mapping plus the ones applied to header/footer cells
+TEMPLATE_PARAGRAPH_STYLES = ["00_TEXT", "00_BULLET", "00_TITLE TABLE", "00_PICTURE", "00_HEADER", "00_HEADER TITLE"]
+TEMPLATE_CHARACTER_STYLES = ["00_BOLD"]
+
+WORDS = ("check the label position and confirm the fitment against the station drawing before release "
+         "operator shall record the result in the traveler and escalate any deviation").split()
+
+
+def make_template(path):
+    """Save a template like resources/template.docx: required styles, a 4x6 header table, a 1x3 footer
+    table, an Approval Table and a Revision History table."""
+    doc = Document()
+    for name in TEMPLATE_PARAGRAPH_STYLES:
+        doc.styles.add_style(name, WD_STYLE_TYPE.PARAGRAPH)
+    for name in TEMPLATE_CHARACTER_STYLES:
+        doc.styles.add_style(name, WD_STYLE_TYPE.CHARACTER)
+
+    section = doc.sections[0]
+    section.header.add_table(4, 6, Inches(6.5))
+    section.footer.add_table(1, 3, Inches(6.5))
+
+    for anchor, columns in (("Approval Table", 4), ("Revision History", 3)):
+        table = doc.add_table(rows=3, cols=columns)
+        table.cell(0, 0).text = anchor
+    doc.add_paragraph("Created from Template LLDC Rev 1")
+    doc.save(path)
+
+
+def make_image(size, seed):
+    """PNG of size (width, height) pixels filled with noise, so it does not compress to nothing."""
+    from PIL import Image
+
+    rng = random.Random(seed)
+    image = Image.frombytes("RGB", size, bytes(rng.getrandbits(8) for _ in range(size[0] * size[1] * 3)))
+    stream = io.BytesIO()
+    image.save(stream, "PNG")
+    stream.seek(0)
+    return stream
+
+
+def make_source_document(path, paragraphs=100, tables=2, table_rows=10, table_columns=4, runs_per_paragraph=3,
+                         images=0, image_size=(200, 150), header_tables=True, table_images=False, seed=0):
+    """Save a legacy-style source document whose size is set along each axis.
+
+    runs_per_paragraph controls run fragmentation (the same words split over that many runs, with repeated
+    formatting). Tables are spread evenly through the body; each image is followed by a 'Figure N' caption.
+    With table_images, each image is drawn in a 1x1 table above its caption instead of in a paragraph.
+    Pillow is needed only when images > 0.
+    """
+    rng = random.Random(seed)
+    doc = Document()
+
+    if header_tables:
+        section = doc.sections[0]
+        header = section.header.add_table(4, 6, Inches(6.5))
+        header.cell(0, 5).text = "SOP-0001"
+        header.cell(1, 4).text = "Rev A"
+        header.cell(2, 3).text = "Manufacturing Engineering"
+        header.cell(3, 0).text = "Synthetic Station Operations"
+        section.footer.add_table(1, 3, Inches(6.5)).cell(0, 2).text = "Controlled copy"
+
+    for anchor, columns in (("Approval Table", 4), ("Revision History", 3)):
+        table = doc.add_table(rows=3, cols=columns)
+        table.cell(0, 0).text = anchor
+        for column in range(columns):
+            table.cell(2, column).text = f"{anchor.split()[0]} {column}"
+
+    doc.add_paragraph("Purpose", style="Heading 1")
+
+    table_every = paragraphs // tables if tables else None
+    image_every = paragraphs // images if images else None
+    figure = 0
+
+    for index in range(paragraphs):
+        words = [rng.choice(WORDS) for _ in range(max(runs_per_paragraph, 8))]
+        paragraph = doc.add_paragraph(style="List Paragraph" if index % 7 == 0 else None)
+        if index % 7 == 0:
+            paragraph._p.get_or_add_pPr().append(parse_xml(
+                f'<w:numPr {nsdecls("w")}><w:ilvl w:val="0"/><w:numId w:val="1"/></w:numPr>'))
+        chunk = max(1, len(words) // runs_per_paragraph)
+        for start in range(0, len(words), chunk):
+            run = paragraph.add_run(" ".join(words[start:start + chunk]) + " ")
+            run.bold = index % 11 == 0
+
+        if table_every and index % table_every == table_every - 1:
+            table = doc.add_table(rows=table_rows, cols=table_columns)
+            table.style = "Table Grid"
+            for row_index, row in enumerate(table.rows):
+                for column, cell in enumerate(row.cells):
+                    cell.text = f"P/N {index:05d}-{row_index:03d}-{column}"
+
+        if image_every and index % image_every == image_every - 1 and figure < images:
+            figure += 1
+            picture_paragraph = doc.add_table(rows=1, cols=1).cell(0, 0).paragraphs[0] if table_images \
+                else doc.add_paragraph()
+            picture_paragraph.add_run().add_picture(make_image(image_size, seed + figure), width=Inches(4.0))
+            doc.add_paragraph(f"Figure {figure}: Station view {figure}", style="Caption")
+
+    doc.save(path)